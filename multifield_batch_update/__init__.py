@@ -16,7 +16,7 @@ import sys
 
 from .__version__ import __version__  # noqa: F401
 
-# Don't import dialog when testing since we don't have the anki
-# libraries available.
-if "pytest" not in sys.modules:
+# Only set up the menus when loaded as an add-on by Anki, which has already imported aqt.  Tests
+# and the command-line entry point run without the GUI and must not import any Qt modules.
+if "aqt" in sys.modules:
     from . import setup_menus  # noqa: F401
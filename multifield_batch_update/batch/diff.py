@@ -0,0 +1,71 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import difflib
+import html
+
+from .planner import BatchUpdateError
+
+DIFF_PRE = """<html>
+<head>
+<style>
+p {
+    font-family: "Lucida Console", Monaco, monospace;
+}
+ins {
+    background-color: lightgreen;
+    text-decoration: none;
+}
+del {
+    background-color: lightpink;
+    text-decoration: none;
+}
+</style>
+</head>
+<body>"""
+
+DIFF_POST = """</body>
+</html>
+"""
+
+
+def html_diff(a, b):
+    sm = difflib.SequenceMatcher(None, a, b)
+    output = []
+    for opcode, a0, a1, b0, b1 in sm.get_opcodes():
+        if opcode == 'equal':
+            output.append(sm.a[a0:a1])
+        elif opcode == 'insert':
+            output.append("<ins>" + sm.b[b0:b1] + "</ins>")
+        elif opcode == 'delete':
+            output.append("<del>" + sm.a[a0:a1] + "</del>")
+        elif opcode == 'replace':
+            output.append("<del>" + sm.a[a0:a1] + "</del>")
+            output.append("<ins>" + sm.b[b0:b1] + "</ins>")
+        else:
+            raise BatchUpdateError("unexpected opcode")
+    return ''.join(output)
+
+
+def write_html_diff(file, note_changes):
+    with open(file, "w", encoding="utf-8") as outf:
+        outf.write(DIFF_PRE)
+        for nid, changes in note_changes.items():
+            outf.write("<p>nid {}:</p>\n".format(nid))
+            for change in changes:
+                outf.write("<p>{}: {}</p>\n".format(
+                    change.fld,
+                    html_diff(html.escape(change.old),
+                              html.escape(change.new))))
+        outf.write(DIFF_POST)
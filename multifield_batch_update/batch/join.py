@@ -0,0 +1,80 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict
+
+
+def normalize_each(normalize):
+    """Adapts a function normalizing single values to composite keys, which are tuples of values."""
+    def normalize_composite(raw):
+        return tuple(normalize(value) for value in raw)
+    return normalize_composite
+
+
+def format_key(raw):
+    """Formats a single or composite key value for messages."""
+    return " + ".join(raw) if isinstance(raw, tuple) else raw
+
+
+class KeyIndex:
+    """Maps join key values to the item (nid or file row) having that value.
+
+    When a normalize function is provided each raw value is normalized exactly once as it is added, and the
+    index is keyed by the normalized value.  Lookups must then use normalized values as well, which callers
+    get by keeping the keys returned from add() rather than normalizing again.
+
+    Two kinds of problems are tracked rather than raised, so that all of them can be reported at once:
+
+    * duplicates: the same raw value was added more than once
+    * collisions: different raw values became the same key after normalization
+    """
+
+    def __init__(self, normalize=None):
+        self.normalize = normalize
+        self.key_to_item = {}
+        self.key_to_raw = {}
+        self.duplicates = set()
+        self.collisions = defaultdict(set)
+
+    def add(self, raw, item):
+        """Adds an item under its raw key value and returns the key it is indexed by."""
+        key = self.normalize(raw) if self.normalize else raw
+        if key in self.key_to_item:
+            existing_raw = self.key_to_raw[key]
+            if existing_raw == raw:
+                self.duplicates.add(raw)
+            else:
+                self.collisions[key].update((existing_raw, raw))
+        else:
+            self.key_to_item[key] = item
+            self.key_to_raw[key] = raw
+        return key
+
+    def get(self, key):
+        return self.key_to_item.get(key)
+
+    def raw(self, key):
+        return self.key_to_raw[key]
+
+    def has_errors(self):
+        return bool(self.duplicates or self.collisions)
+
+    def __contains__(self, key):
+        return key in self.key_to_item
+
+    def __len__(self):
+        return len(self.key_to_item)
+
+    def items(self):
+        return self.key_to_item.items()
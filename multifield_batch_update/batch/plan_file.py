@@ -0,0 +1,107 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import time
+
+from anki.utils import ids2str
+
+from .plan_store import DEFAULT_MEMORY_LIMIT, NoteChange, PlanStore
+from .planner import BatchUpdateError, Plan
+
+PLAN_FILE_VERSION = 1
+
+# How many nids to check per query when validating a plan against the collection.
+VALIDATE_CHUNK_SIZE = 10000
+
+
+def write_plan(path, plan, **info):
+    """Saves a plan as gzipped JSON lines.
+
+    The first line is a header with the format version and any extra info describing how the plan was
+    made, such as the join keys.  Each following line holds one note: its nid, its mod time when planned,
+    and its changes as [field, old, new] triples.
+    """
+    header = dict(info, version=PLAN_FILE_VERSION, created=int(time.time()),
+                  empty_note_field_count=plan.empty_note_field_count,
+                  empty_note_count=plan.empty_note_count,
+                  skipped_field_count=plan.skipped_field_count,
+                  skipped_note_count=plan.skipped_note_count,
+                  skipped_sync_bytes=plan.skipped_sync_bytes)
+    with gzip.open(path, "wt", encoding="utf-8") as outf:
+        outf.write(json.dumps(header) + "\n")
+        for nid, mod, changes in plan.note_changes.grouped():
+            outf.write(json.dumps([nid, mod, [[change.fld, change.old, change.new] for change in changes]]) + "\n")
+
+
+def read_plan(path, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Loads a plan saved by write_plan, returning the header and the plan."""
+    with gzip.open(path, "rt", encoding="utf-8") as inf:
+        header = json.loads(inf.readline() or "{}")
+        if header.get("version") != PLAN_FILE_VERSION:
+            raise BatchUpdateError("{} is not a plan file this version can read".format(path))
+        note_changes = PlanStore(memory_limit)
+        for line in inf:
+            nid, mod, changes = json.loads(line)
+            note_changes.add_note(nid, mod, [NoteChange(nid=nid, fld=fld, old=old, new=new)
+                                             for fld, old, new in changes])
+    return header, Plan(note_changes=note_changes,
+                        empty_note_field_count=header["empty_note_field_count"],
+                        empty_note_count=header["empty_note_count"],
+                        # plans saved before formatting-only changes could be skipped don't have these
+                        skipped_field_count=header.get("skipped_field_count", 0),
+                        skipped_note_count=header.get("skipped_note_count", 0),
+                        skipped_sync_bytes=header.get("skipped_sync_bytes", 0))
+
+
+def find_stale_notes(col, notes):
+    """Compares the planned mod times, given as (nid, mod) pairs, against the collection in bulk.
+
+    Returns the set of nids modified since planning and the set of nids that no longer exist.
+    """
+    changed = set()
+    missing = set()
+    chunk = {}
+    for nid, mod in notes:
+        chunk[nid] = mod
+        if len(chunk) >= VALIDATE_CHUNK_SIZE:
+            _check_chunk(col, chunk, changed, missing)
+            chunk = {}
+    if chunk:
+        _check_chunk(col, chunk, changed, missing)
+    return changed, missing
+
+
+def _check_chunk(col, note_mods, changed, missing):
+    found = set()
+    for nid, mod in col.db.all("select id, mod from notes where id in {}".format(ids2str(note_mods))):
+        found.add(nid)
+        if mod != note_mods[nid]:
+            changed.add(nid)
+    missing.update(set(note_mods) - found)
+
+
+def without_notes(plan, nids):
+    """Returns a copy of the plan leaving out the given notes."""
+    note_changes = plan.note_changes.without_notes(nids)
+    empty_note_field_count = 0
+    empty_note_count = 0
+    for nid, changes in note_changes.items():
+        empty_fields = sum(1 for change in changes if not change.old)
+        if empty_fields:
+            empty_note_field_count += empty_fields
+            empty_note_count += 1
+    return plan._replace(note_changes=note_changes, empty_note_field_count=empty_note_field_count,
+                         empty_note_count=empty_note_count)
@@ -0,0 +1,163 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sqlite3
+import tempfile
+from array import array
+from collections import namedtuple
+
+NoteChange = namedtuple("NoteChange", ["nid", "fld", "old", "new"])
+
+# Approximate bytes of change data held in memory before it is moved to a temporary database.
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Rough per-change overhead of the Python objects holding the old and new values.
+_CHANGE_OVERHEAD = 120
+
+
+class PlanStore:
+    """Compact, append-only storage for the changes planned for each note.
+
+    Changes are kept column-wise: nids and mod times as integer arrays, field names interned as indices
+    into a shared list, and old and new values in plain lists.  Once the values held in memory pass
+    memory_limit bytes they are moved to a temporary SQLite database, so memory use stays bounded no
+    matter how large the plan is.  Notes are always read back in the order they were added.
+    """
+
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        self.field_names = []
+        self._field_index = {}
+        self._note_count = 0
+        self._change_count = 0
+        self._db = None
+        self._db_path = None
+        self._reset_memory()
+
+    def _reset_memory(self):
+        # one entry per change
+        self._nids = array("q")
+        self._mods = array("q")
+        self._flds = array("H")
+        self._olds = []
+        self._news = []
+        self._memory_size = 0
+
+    def add_note(self, nid, mod, changes):
+        """Adds the changes for a note.  Each note should only be added once."""
+        for change in changes:
+            fld = self._field_index.get(change.fld)
+            if fld is None:
+                fld = self._field_index[change.fld] = len(self.field_names)
+                self.field_names.append(change.fld)
+            self._nids.append(nid)
+            self._mods.append(mod)
+            self._flds.append(fld)
+            self._olds.append(change.old)
+            self._news.append(change.new)
+            self._memory_size += len(change.old) + len(change.new) + _CHANGE_OVERHEAD
+            self._change_count += 1
+        self._note_count += 1
+        if self._memory_size > self.memory_limit:
+            self._spill()
+
+    def _spill(self):
+        if self._db is None:
+            fd, self._db_path = tempfile.mkstemp(prefix="batch_update_plan_", suffix=".db")
+            os.close(fd)
+            self._db = sqlite3.connect(self._db_path)
+            self._db.executescript("""
+                pragma journal_mode = off;
+                pragma synchronous = off;
+                create table changes (
+                  seq integer primary key,
+                  nid integer not null,
+                  mod integer not null,
+                  fld integer not null,
+                  old text not null,
+                  new text not null
+                );
+            """)
+        self._db.executemany(
+            "insert into changes (nid, mod, fld, old, new) values (?,?,?,?,?)",
+            zip(self._nids, self._mods, self._flds, self._olds, self._news))
+        self._db.commit()
+        self._reset_memory()
+
+    @property
+    def spilled(self):
+        return self._db is not None
+
+    def close(self):
+        """Deletes the temporary database, if any.  The store cannot be used afterwards."""
+        if self._db is not None:
+            self._db.close()
+            os.remove(self._db_path)
+            self._db = None
+        self._reset_memory()
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self):
+        return self._note_count
+
+    def change_count(self):
+        return self._change_count
+
+    def _rows(self):
+        if self._db is not None:
+            yield from self._db.execute("select nid, mod, fld, old, new from changes order by seq")
+        yield from zip(self._nids, self._mods, self._flds, self._olds, self._news)
+
+    def grouped(self):
+        """Yields (nid, mod, list of NoteChange) for each note, in the order they were added."""
+        field_names = self.field_names
+        nid = mod = None
+        changes = []
+        for row_nid, row_mod, fld, old, new in self._rows():
+            if row_nid != nid:
+                if changes:
+                    yield nid, mod, changes
+                nid, mod = row_nid, row_mod
+                changes = []
+            changes.append(NoteChange(nid=nid, fld=field_names[fld], old=old, new=new))
+        if changes:
+            yield nid, mod, changes
+
+    def items(self):
+        """Yields (nid, list of NoteChange) for each note, in the order they were added."""
+        for nid, mod, changes in self.grouped():
+            yield nid, changes
+
+    def notes(self):
+        """Yields (nid, mod) for each note, in the order they were added."""
+        nid = None
+        for row_nid, mod, fld, old, new in self._rows():
+            if row_nid != nid:
+                nid = row_nid
+                yield nid, mod
+
+    def nids(self):
+        for nid, mod in self.notes():
+            yield nid
+
+    def without_notes(self, nids):
+        """Returns a new store with the changes for all but the given notes."""
+        store = PlanStore(self.memory_limit)
+        for nid, mod, changes in self.grouped():
+            if nid not in nids:
+                store.add_note(nid, mod, changes)
+        return store
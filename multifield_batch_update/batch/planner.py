@@ -0,0 +1,382 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import time
+from collections import namedtuple
+from operator import itemgetter
+
+from anki.utils import ids2str, splitFields
+
+from ..db.change_log import ChangeLogEntry
+from ..text.html import html_equivalent
+from .join import KeyIndex, format_key, normalize_each
+from .plan_store import DEFAULT_MEMORY_LIMIT, NoteChange, PlanStore
+
+# Maps a column in the file to a field in the note.  The transform is a compiled function taking
+# the file row and the current note value and returning the new note value.
+FieldMapping = namedtuple("FieldMapping", ["file_field", "note_field", "transform"])
+
+# One file to plan changes from: how to join its rows to notes, which of its columns go to which note
+# fields, and the function normalizing join key values, if any.  A composite join key is given as
+# tuples of file and note field names of the same length, and nid can only be joined on by itself.
+FileJob = namedtuple("FileJob", ["file", "file_join_key", "note_join_key", "mappings", "normalize"])
+
+# How many notes to read per query when indexing join keys.
+NOTE_CHUNK_SIZE = 10000
+
+# The result of planning.  note_changes is a PlanStore holding the list of NoteChange to make to each
+# note, along with the note's mod time when it was planned so that a saved plan can detect notes
+# edited since.  The skipped counts cover fields that were left alone because the new value only differs in
+# HTML formatting, and the notes and approximate sync bytes that saved from being written.
+Plan = namedtuple("Plan", ["note_changes", "empty_note_field_count", "empty_note_count",
+                           "skipped_field_count", "skipped_note_count", "skipped_sync_bytes"])
+
+
+class BatchUpdateError(Exception):
+    """Thrown when unexpected error occurs"""
+    pass
+
+
+def _ignore(msg):
+    pass
+
+
+def read_file_field_names(file):
+    with open(file, encoding="utf-8") as inf:
+        reader = csv.DictReader(inf)
+
+        # load field names as list of strings
+        return reader.fieldnames
+
+
+def join_key_names(key):
+    """Returns the field names making up a join key, which is a single name or a tuple of names."""
+    return (key,) if isinstance(key, str) else tuple(key)
+
+
+def default_join_keys(file_field_names, note_field_names):
+    """Picks the join keys the same way the dialog preselects them."""
+    if "nid" in file_field_names:
+        file_join_key_name = "nid"
+    else:
+        file_join_key_name = file_field_names[0]
+    return file_join_key_name, default_note_join_key(file_join_key_name, note_field_names)
+
+
+def default_note_join_key(file_join_key_name, note_field_names):
+    """Joins on the note fields named the same as the file join key, or on nid if there aren't any."""
+    names = join_key_names(file_join_key_name)
+    if (len(names) == 1 and names[0] == "nid") or all(name in note_field_names for name in names):
+        return file_join_key_name
+    return "nid"
+
+
+def default_mappings(file_field_names, note_field_names, note_join_key_name):
+    """Maps file columns to note fields with the same name, as the dialog does by default."""
+    note_join_key_names = join_key_names(note_join_key_name)
+    return {
+        name: name for name in file_field_names
+        if name != "nid" and name not in note_join_key_names and name in note_field_names
+    }
+
+
+def plan_changes(col, nids, file, file_join_key_name, note_join_key_name, mappings, *,
+                 normalize=None, ignore_equivalent_html=False, memory_limit=DEFAULT_MEMORY_LIMIT, log=_ignore):
+    """Determines which note fields need to change so they match the values in the file.
+
+    The notes must all be of the same model.  Progress is reported line by line through log, and any
+    problem that prevents the plan from being used raises a BatchUpdateError.  Changes beyond
+    memory_limit bytes are kept in a temporary database rather than in memory.
+
+    With ignore_equivalent_html, a value that only differs from the note's in HTML formatting that Anki
+    renders the same, such as &nbsp; versus a space or attribute order, is not treated as a change.
+    """
+    job = FileJob(file, file_join_key_name, note_join_key_name, mappings, normalize)
+    return plan_jobs(col, nids, [job], ignore_equivalent_html=ignore_equivalent_html,
+                     memory_limit=memory_limit, log=log)
+
+
+def plan_jobs(col, nids, jobs, *, ignore_equivalent_html=False, memory_limit=DEFAULT_MEMORY_LIMIT, log=_ignore):
+    """Plans the changes for several files at once, merging them so each note is read and written once.
+
+    Each file has its own join keys and mappings.  If two files would set the same field of a note to
+    different values a BatchUpdateError is raised listing the conflicts.  See plan_changes for the rest.
+    """
+    for job in jobs:
+        if not job.mappings:
+            raise BatchUpdateError("No mappings selected for {}".format(job.file))
+
+    first_note = col.getNote(nids[0])
+    model_id = first_note.mid
+    note_field_names = col.models.fieldNames(first_note.model())
+
+    for job in jobs:
+        if len(join_key_names(job.file_join_key)) != len(join_key_names(job.note_join_key)):
+            raise BatchUpdateError("Join keys {} and {} have a different number of fields".format(
+                _format_key_names(job.file_join_key), _format_key_names(job.note_join_key)))
+        if "nid" in join_key_names(job.note_join_key) and job.note_join_key != "nid":
+            raise BatchUpdateError("nid can't be combined with other fields in a join key")
+
+    # Check which key values exist and to make sure there are no duplicate values.
+    # Build a mapping form these key values to the row which contains the field values.
+    file_indices = [_read_file_index(job, log) for job in jobs]
+
+    # When we aren't joining by nid, we need to create an additional mapping from the join
+    # key to the nid value, because we can only look up by nid.  Files joining on the same
+    # note fields share an index, and all indices are built in one pass over the notes.
+    note_indices = {}
+    for job in jobs:
+        if job.note_join_key != "nid":
+            for note_join_key_name in join_key_names(job.note_join_key):
+                if note_join_key_name not in note_field_names:
+                    raise BatchUpdateError("Field '{}' not found in note type".format(note_join_key_name))
+            note_indices.setdefault((job.note_join_key, job.normalize), _key_index(job.note_join_key, job.normalize))
+    if note_indices:
+        log("Joining to notes by {}, so finding all values.".format(
+            ", ".join("'{}'".format(_format_key_names(key)) for key, normalize in note_indices)))
+        _index_notes(col, nids, model_id, note_field_names, note_indices)
+        errors = []
+        for (note_join_key_name, normalize), note_join_key_to_nid in note_indices.items():
+            for val in note_join_key_to_nid.duplicates:
+                errors.append("Value '{}' already exists in notes".format(format_key(val)))
+            if note_join_key_to_nid.collisions:
+                errors.extend(_collision_errors(note_join_key_to_nid.collisions, "note field '{}'".format(
+                    _format_key_names(note_join_key_name))))
+        if errors:
+            raise BatchUpdateError("\n".join(errors))
+
+    # The rows from every file that apply to each note, in the order the notes are first seen.
+    nid_to_rows = {}
+    for job, file_key_to_values in zip(jobs, file_indices):
+        if job.note_join_key != "nid":
+            note_join_key_to_nid = note_indices[(job.note_join_key, job.normalize)]
+
+        # track join keys that were not found in notes
+        missing_note_keys = set()
+
+        for file_key, file_values in file_key_to_values.items():
+
+            if job.note_join_key == "nid":
+                try:
+                    nid = int(file_key)
+                except ValueError:
+                    raise BatchUpdateError("Value '{}' for '{}' is not a valid nid".format(
+                        file_key, job.file_join_key))
+            else:
+                # Keys on both sides were normalized once while building the indices, so this is
+                # a plain dict lookup.
+                raw_file_key = format_key(file_key_to_values.raw(file_key))
+                nid = note_join_key_to_nid.get(file_key)
+                if nid is not None:
+                    log("Found note {} with value {} for '{}'".format(
+                        nid, raw_file_key, _format_key_names(job.note_join_key)))
+                else:
+                    log("Could not find note with value {} for '{}'".format(
+                        raw_file_key, _format_key_names(job.note_join_key)))
+                    missing_note_keys.add(raw_file_key)
+                    continue
+
+            nid_to_rows.setdefault(nid, []).append((job, file_values))
+
+        if missing_note_keys:
+            raise BatchUpdateError("{} values were not found in notes for field '{}'{}".format(
+                len(missing_note_keys), _format_key_names(job.note_join_key), _in_file(job, jobs)))
+
+    # these store the changes we will propose to make (grouped by nid)
+    note_changes = PlanStore(memory_limit)
+
+    # fields that more than one file would set to different values
+    conflicts = []
+
+    # how many fields being updated are empty
+    empty_note_field_count = 0
+    empty_note_count = 0
+
+    # how many changes were skipped because they only differ in formatting
+    skipped_field_count = 0
+    skipped_note_count = 0
+    skipped_sync_bytes = 0
+
+    for nid, rows in nid_to_rows.items():
+
+        log("Checking note {}".format(nid))
+
+        try:
+            note = col.getNote(nid)
+        except TypeError:
+            raise BatchUpdateError("Note {} was not found".format(nid))
+
+        # Compare the file field values to the note field values and see if anything is different
+        # and therefore needs to be updated.  Every transform sees the value the note has now.
+        new_values = {}
+        for job, file_values in rows:
+            for mapping in job.mappings:
+                if mapping.note_field not in note:
+                    raise BatchUpdateError("Field '{}' not found in note {}".format(mapping.note_field, nid))
+                file_value = mapping.transform(file_values, note[mapping.note_field])
+                if mapping.note_field in new_values:
+                    other_job, other_value = new_values[mapping.note_field]
+                    if other_value != file_value:
+                        conflicts.append("Note {} field '{}' is set to {!r} by {} and {!r} by {}".format(
+                            nid, mapping.note_field, other_value, other_job.file, file_value, job.file))
+                    continue
+                new_values[mapping.note_field] = (job, file_value)
+
+        changes = []
+        skipped_fields = 0
+        for note_field_name, (job, file_value) in new_values.items():
+            note_value = note[note_field_name]
+            if file_value != note_value:
+                if ignore_equivalent_html and html_equivalent(file_value, note_value):
+                    log("Skipping note field '{}' which only differs in formatting".format(note_field_name))
+                    skipped_fields += 1
+                    continue
+                log("Need to update note field '{}':".format(note_field_name))
+                log("{}\n=>\n{}".format(note_value or "<empty>", file_value))
+                changes.append(NoteChange(nid=nid, fld=note_field_name,
+                                          old=note_value, new=file_value))
+        skipped_field_count += skipped_fields
+        if skipped_fields and not changes:
+            # The whole note would have been written, bumping its mod time so it is sent in full at the next sync.
+            skipped_note_count += 1
+            skipped_sync_bytes += sum(len(value.encode("utf-8")) for value in note.fields)
+        if changes:
+            note_changes.add_note(nid, note.mod, changes)
+            empty_fields = sum(1 for change in changes if not change.old)
+            if empty_fields:
+                empty_note_field_count += empty_fields
+                empty_note_count += 1
+
+    if conflicts:
+        note_changes.close()
+        raise BatchUpdateError("Found {} fields set to different values by more than one file:\n{}".format(
+            len(conflicts), "\n".join(conflicts)))
+
+    if note_changes:
+        log("Need to make changes to {} notes".format(len(note_changes)))
+        if empty_note_field_count:
+            log("{} fields across {} notes are empty".format(
+                empty_note_field_count, empty_note_count))
+        if note_changes.spilled:
+            log("Plan exceeded {} bytes, so changes are being kept on disk".format(memory_limit))
+    if skipped_field_count:
+        log("Skipped {} fields that only differ in formatting, avoiding writes to {} notes "
+            "and about {:.1f} KB of sync".format(skipped_field_count, skipped_note_count, skipped_sync_bytes / 1024))
+
+    return Plan(note_changes=note_changes, empty_note_field_count=empty_note_field_count,
+                empty_note_count=empty_note_count, skipped_field_count=skipped_field_count,
+                skipped_note_count=skipped_note_count, skipped_sync_bytes=skipped_sync_bytes)
+
+
+def apply_changes(col, note_changes, changelog, *, op="batch_update"):
+    """Writes the planned changes to the notes, recording each one in the changelog.
+
+    Returns the number of notes updated.  This waits for the changelog to be committed, even if an error
+    interrupts the update part way through, so that it always covers the notes that were flushed.
+    """
+    updated_count = 0
+    try:
+        init_ts = int(time.time() * 1000)
+
+        for nid, changes in note_changes.items():
+            note = col.getNote(nid)
+            for change in changes:
+                ts = int(time.time() * 1000)
+                note[change.fld] = change.new
+                changelog.record_change(
+                    op, init_ts,
+                    ChangeLogEntry(
+                        ts=ts, nid=nid, fld=change.fld,
+                        old=change.old, new=change.new))
+            note.flush()
+            updated_count += 1
+    except BaseException:
+        # The error that stopped the update is the one to report, even if the changelog fails as well.
+        try:
+            changelog.flush()
+        except Exception:
+            pass
+        raise
+    changelog.flush()
+    return updated_count
+
+
+def _format_key_names(key):
+    return " + ".join(join_key_names(key))
+
+
+def _key_index(key, normalize):
+    if normalize is not None and not isinstance(key, str):
+        normalize = normalize_each(normalize)
+    return KeyIndex(normalize)
+
+
+def _index_notes(col, nids, model_id, note_field_names, note_indices):
+    """Adds the join key values of every note to each index, reading the notes in chunks.
+
+    This reads the raw fields straight from the database instead of loading each Note, which keeps
+    building the indices linear and fast even for a very large number of notes.
+    """
+    # itemgetter returns a single value for one field and a tuple for a composite key, matching the file side
+    getters = [
+        (itemgetter(*[note_field_names.index(name) for name in join_key_names(note_join_key_name)]), index)
+        for (note_join_key_name, normalize), index in note_indices.items()
+    ]
+    for i in range(0, len(nids), NOTE_CHUNK_SIZE):
+        chunk = nids[i:i + NOTE_CHUNK_SIZE]
+        for nid, mid, flds in col.db.all("select id, mid, flds from notes where id in {}".format(ids2str(chunk))):
+            if mid != model_id:
+                raise BatchUpdateError(
+                    "Note {} has different model ID {} than expected {} based on first note. ".format(
+                        nid, mid, model_id) + "Please only select notes of the same model.")
+            fields = splitFields(flds)
+            for getter, index in getters:
+                index.add(getter(fields), nid)
+
+
+def _read_file_index(job, log):
+    file_key_to_values = _key_index(job.file_join_key, job.normalize)
+    file_join_key_names = join_key_names(job.file_join_key)
+    with open(job.file, encoding="utf-8") as inf:
+        reader = csv.DictReader(inf)
+        for name in file_join_key_names:
+            if name not in reader.fieldnames:
+                raise BatchUpdateError("Field '{}' not found in {}".format(name, job.file))
+        get_key = itemgetter(*file_join_key_names)
+        for row in reader:
+            file_key_to_values.add(get_key(row), row)
+    errors = []
+    if file_key_to_values.duplicates:
+        errors.append("Found {} key values for '{}' in {} that appear more than once:".format(
+            len(file_key_to_values.duplicates), _format_key_names(job.file_join_key), job.file))
+        errors.extend(format_key(val) for val in file_key_to_values.duplicates)
+    if file_key_to_values.collisions:
+        errors.extend(_collision_errors(file_key_to_values.collisions, "file field '{}' in {}".format(
+            _format_key_names(job.file_join_key), job.file)))
+    if errors:
+        raise BatchUpdateError("\n".join(errors))
+    log("Found {} records for '{}' in {}".format(
+        len(file_key_to_values), _format_key_names(job.file_join_key), job.file))
+    return file_key_to_values
+
+
+def _in_file(job, jobs):
+    return " in {}".format(job.file) if len(jobs) > 1 else ""
+
+
+def _collision_errors(collisions, source):
+    yield "Found {} key values for {} that are only distinct before normalization:".format(len(collisions), source)
+    for raw_values in collisions.values():
+        yield " == ".join(repr(format_key(val)) for val in sorted(raw_values))
@@ -0,0 +1,107 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+VALUE = "Value"
+TEMPLATE = "Template"
+REGEX_REPLACE = "Regex Replace"
+APPEND = "Append"
+PREPEND = "Prepend"
+
+TRANSFORM_KINDS = [VALUE, TEMPLATE, REGEX_REPLACE, APPEND, PREPEND]
+
+# Placeholder text describing the two arguments for each kind of transform.  None means the argument is unused.
+TRANSFORM_ARGS = {
+    VALUE: (None, None),
+    TEMPLATE: ("e.g. <b>{{Word}}</b> ({{POS}})", None),
+    REGEX_REPLACE: ("Pattern", "Replacement"),
+    APPEND: ("Separator", None),
+    PREPEND: ("Separator", None),
+}
+
+_TEMPLATE_FIELD_RE = re.compile(r"{{(.+?)}}")
+
+
+class TransformError(Exception):
+    """Thrown when a transform cannot be compiled"""
+    pass
+
+
+def compile_transform(kind, column, arg1, arg2, file_field_names):
+    """Compiles a transform for a file column into a function taking the file row and current note value.
+
+    All parsing and validation happens here so that the returned function does no more than the minimal
+    work per value when it is applied for every row during planning.
+    """
+    if kind == VALUE:
+        def transform(row, old):
+            return row[column]
+    elif kind == TEMPLATE:
+        transform = _compile_template(arg1, file_field_names)
+    elif kind == REGEX_REPLACE:
+        if not arg1:
+            raise TransformError("Regex for '{}' is empty".format(column))
+        try:
+            pattern = re.compile(arg1)
+        except re.error as e:
+            raise TransformError("Invalid regex for '{}': {}".format(column, e))
+        try:
+            # The replacement is parsed, and its group references checked, before anything is matched,
+            # so substituting into an empty string validates it without needing a row.
+            pattern.sub(arg2, "")
+        except (re.error, IndexError) as e:
+            raise TransformError("Invalid replacement for '{}': {}".format(column, e))
+
+        def transform(row, old):
+            return pattern.sub(arg2, row[column])
+    elif kind == APPEND:
+        separator = arg1
+
+        def transform(row, old):
+            value = row[column]
+            return old + separator + value if old and value else old + value
+    elif kind == PREPEND:
+        separator = arg1
+
+        def transform(row, old):
+            value = row[column]
+            return value + separator + old if old and value else value + old
+    else:
+        raise TransformError("Unknown transform '{}' for '{}'".format(kind, column))
+    return transform
+
+
+def describe_transform(kind, arg1, arg2):
+    if kind == VALUE:
+        return ""
+    elif kind == REGEX_REPLACE:
+        return " ({} {!r} -> {!r})".format(kind, arg1, arg2)
+    else:
+        return " ({} {!r})".format(kind, arg1)
+
+
+def _compile_template(template, file_field_names):
+    if not template:
+        raise TransformError("Template is empty")
+
+    # Split the template into alternating literal text and column names once.  Odd indices are column names.
+    parts = _TEMPLATE_FIELD_RE.split(template)
+    missing = [name for name in parts[1::2] if name not in file_field_names]
+    if missing:
+        raise TransformError("Template refers to columns not in the file: {}".format(", ".join(missing)))
+
+    def transform(row, old):
+        return "".join(row[part] if i % 2 else part for i, part in enumerate(parts))
+    return transform
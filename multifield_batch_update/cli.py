@@ -0,0 +1,268 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Command-line entry point for running a batch update against a collection file without the Anki GUI.
+
+    python -m multifield_batch_update.cli collection.anki2 changes.csv --search "note:Vocab" --mode dryrun
+
+The plan can be saved with --save-plan and later used by diff or update with --plan instead of the CSV file.
+
+A JSON summary is printed to stdout and the exit status is 0 on success, 1 if the update could not be
+planned or applied, 2 for invalid arguments, and 3 if a saved plan was used but some of its notes were
+skipped because they changed after it was made.
+"""
+
+import argparse
+import json
+import sys
+import traceback
+
+from anki import Collection
+
+from .batch.diff import write_html_diff
+from .batch.plan_file import find_stale_notes, read_plan, without_notes, write_plan
+from .batch.plan_store import DEFAULT_MEMORY_LIMIT
+from .batch.planner import (BatchUpdateError, FieldMapping, apply_changes, default_join_keys, default_mappings,
+                            default_note_join_key, join_key_names, plan_changes, read_file_field_names)
+from .batch.transforms import TRANSFORM_KINDS, VALUE, TransformError, compile_transform
+from .db.change_log import ChangeLog
+from .text.html import normalize_key
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_STALE = 3
+
+MODES = ["dryrun", "diff", "update"]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m multifield_batch_update.cli",
+        description="Update fields of notes in an Anki collection from a CSV file.")
+    parser.add_argument("collection", help="path to the .anki2 collection file, which must not be open in Anki")
+    parser.add_argument("file", nargs="?", help="CSV file with a header row.  Not needed with --plan.")
+    parser.add_argument("--mode", choices=MODES, default="dryrun")
+    parser.add_argument("--search", default="",
+                        help="Anki search selecting the notes to update.  They must all have the same note type.")
+    parser.add_argument("--file-join-key", type=_join_key,
+                        help="column in the file to join on, or comma-separated columns for a composite key")
+    parser.add_argument("--note-join-key", type=_join_key,
+                        help="note field to join on, nid, or comma-separated fields matching --file-join-key")
+    parser.add_argument("--normalize-keys", action="store_true",
+                        help="strip HTML, unescape entities, collapse whitespace and ignore case when joining")
+    parser.add_argument("--ignore-formatting", action="store_true",
+                        help="don't update fields whose new value only differs in HTML formatting")
+    parser.add_argument("--map", action="append", default=[], metavar="COLUMN=FIELD",
+                        help="map a file column to a note field.  "
+                             "Defaults to mapping columns to fields with the same name.")
+    parser.add_argument("--transform", action="append", nargs="+", default=[], metavar="ARG",
+                        help="COLUMN KIND [ARG1 [ARG2]] where KIND is one of: {}".format(", ".join(TRANSFORM_KINDS)))
+    parser.add_argument("--save-plan", metavar="PATH", help="save the planned changes to apply later")
+    parser.add_argument("--plan", metavar="PATH",
+                        help="use changes saved with --save-plan rather than planning them from a CSV file")
+    parser.add_argument("--memory-limit", metavar="MB", type=int, default=DEFAULT_MEMORY_LIMIT // (1024 * 1024),
+                        help="keep planned changes beyond this size in a temporary database")
+    parser.add_argument("--diff-output", metavar="PATH", help="where to write the HTML diff in diff mode")
+    parser.add_argument("--changelog", metavar="PATH", help="changelog database to record updates in")
+    parser.add_argument("--verbose", action="store_true", help="log progress to stderr")
+    args = parser.parse_args(argv)
+    if bool(args.file) == bool(args.plan):
+        parser.error("either a CSV file or --plan is required, but not both")
+    if args.plan and args.mode == "dryrun":
+        parser.error("--plan can only be used in diff or update mode")
+    if args.mode == "diff" and not args.diff_output:
+        parser.error("--diff-output is required in diff mode")
+    for transform in args.transform:
+        if not 2 <= len(transform) <= 4:
+            parser.error("--transform takes COLUMN KIND [ARG1 [ARG2]]")
+    for mapping in args.map:
+        if "=" not in mapping:
+            parser.error("--map takes COLUMN=FIELD")
+    return args
+
+
+def _log_to_stderr(msg):
+    print(msg, file=sys.stderr)
+
+
+def _ignore(msg):
+    pass
+
+
+def _join_key(value):
+    names = tuple(value.split(","))
+    return names[0] if len(names) == 1 else names
+
+
+def _build_mappings(args, file_field_names, note_field_names, note_join_key_name):
+    if args.map:
+        file_to_note_mappings = dict(mapping.split("=", 1) for mapping in args.map)
+    else:
+        file_to_note_mappings = default_mappings(file_field_names, note_field_names, note_join_key_name)
+
+    transforms = {}
+    for column, kind, *transform_args in args.transform:
+        arg1, arg2 = (transform_args + ["", ""])[:2]
+        transforms[column] = (kind, arg1, arg2)
+
+    mappings = []
+    for file_field_name, note_field_name in file_to_note_mappings.items():
+        if file_field_name not in file_field_names:
+            raise BatchUpdateError("Column '{}' not found in file".format(file_field_name))
+        if note_field_name not in note_field_names:
+            raise BatchUpdateError("Field '{}' not found in note type".format(note_field_name))
+        # the same restrictions as the dialog's mapping table
+        if file_field_name == "nid":
+            raise BatchUpdateError("Column 'nid' can only be used as a join key")
+        if note_field_name in join_key_names(note_join_key_name):
+            raise BatchUpdateError("Field '{}' is part of the note join key, so it can't also be mapped".format(
+                note_field_name))
+        kind, arg1, arg2 = transforms.pop(file_field_name, (VALUE, "", ""))
+        try:
+            transform = compile_transform(kind, file_field_name, arg1, arg2, file_field_names)
+        except TransformError as e:
+            raise BatchUpdateError(str(e))
+        mappings.append(FieldMapping(file_field_name, note_field_name, transform))
+    if transforms:
+        raise BatchUpdateError("Transforms given for unmapped columns: {}".format(", ".join(transforms)))
+    return mappings
+
+
+def _plan_from_file(col, args, summary, log):
+    nids = col.findNotes(args.search)
+    if not nids:
+        raise BatchUpdateError("No notes match search '{}'".format(args.search))
+    summary["notes_selected"] = len(nids)
+
+    model = col.getNote(nids[0]).model()
+    note_field_names = col.models.fieldNames(model)
+    file_field_names = read_file_field_names(args.file)
+
+    if args.file_join_key:
+        file_join_key_name = args.file_join_key
+        note_join_key_name = default_note_join_key(file_join_key_name, note_field_names)
+    else:
+        file_join_key_name, note_join_key_name = default_join_keys(file_field_names, note_field_names)
+    note_join_key_name = args.note_join_key or note_join_key_name
+    for name in join_key_names(file_join_key_name):
+        if name not in file_field_names:
+            raise BatchUpdateError("Join key '{}' not found in file".format(name))
+    for name in join_key_names(note_join_key_name):
+        if name not in ["nid"] + note_field_names:
+            raise BatchUpdateError("Join key '{}' not found in note type".format(name))
+    log("Join key: File field '{}' -> Note field '{}'".format(
+        " + ".join(join_key_names(file_join_key_name)), " + ".join(join_key_names(note_join_key_name))))
+
+    mappings = _build_mappings(args, file_field_names, note_field_names, note_join_key_name)
+    for mapping in mappings:
+        log("File field '{}' -> Note field '{}'".format(mapping.file_field, mapping.note_field))
+
+    normalize = normalize_key if args.normalize_keys and note_join_key_name != "nid" else None
+    plan = plan_changes(col, nids, args.file, file_join_key_name, note_join_key_name, mappings,
+                        normalize=normalize, ignore_equivalent_html=args.ignore_formatting,
+                        memory_limit=args.memory_limit * 1024 * 1024, log=log)
+
+    if args.save_plan:
+        write_plan(args.save_plan, plan, file=args.file, search=args.search, model_id=model["id"],
+                   file_join_key=file_join_key_name, note_join_key=note_join_key_name)
+        summary["plan_output"] = args.save_plan
+    return plan
+
+
+def _plan_from_saved(col, args, summary, log):
+    header, plan = read_plan(args.plan, args.memory_limit * 1024 * 1024)
+    log("Loaded plan for {} notes made from {}".format(len(plan.note_changes), header.get("file")))
+
+    # Every fingerprint is checked up front, so notes edited after planning are never overwritten.
+    changed, missing = find_stale_notes(col, plan.note_changes.notes())
+    for nid in sorted(changed):
+        log("Skipping note {} which was modified after the plan was made".format(nid))
+    for nid in sorted(missing):
+        log("Skipping note {} which was deleted after the plan was made".format(nid))
+    summary["notes_skipped_modified"] = sorted(changed)
+    summary["notes_skipped_deleted"] = sorted(missing)
+    if changed or missing:
+        filtered = without_notes(plan, changed | missing)
+        plan.note_changes.close()
+        plan = filtered
+    return plan
+
+
+def run(col, args, summary, log):
+    if args.plan:
+        plan = _plan_from_saved(col, args, summary, log)
+    else:
+        plan = _plan_from_file(col, args, summary, log)
+    note_changes = plan.note_changes
+    try:
+        _run_plan(col, args, summary, plan)
+    finally:
+        note_changes.close()
+
+    if summary.get("notes_skipped_modified") or summary.get("notes_skipped_deleted"):
+        return EXIT_STALE
+    return EXIT_OK
+
+
+def _run_plan(col, args, summary, plan):
+    note_changes = plan.note_changes
+    summary["notes_changed"] = len(note_changes)
+    summary["fields_changed"] = note_changes.change_count()
+    summary["empty_fields_changed"] = plan.empty_note_field_count
+    summary["fields_skipped_formatting"] = plan.skipped_field_count
+    summary["note_writes_avoided"] = plan.skipped_note_count
+    summary["sync_bytes_avoided"] = plan.skipped_sync_bytes
+
+    if args.mode == "diff":
+        write_html_diff(args.diff_output, note_changes)
+        summary["diff_output"] = args.diff_output
+    elif args.mode == "update" and note_changes:
+        changelog = ChangeLog(args.changelog)
+        try:
+            summary["notes_updated"] = apply_changes(col, note_changes, changelog)
+        finally:
+            changelog.close()
+            col.save()
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    log = _log_to_stderr if args.verbose else _ignore
+    summary = {"mode": args.mode, "collection": args.collection, "file": args.file, "plan": args.plan}
+
+    status = EXIT_ERROR
+    try:
+        col = Collection(args.collection)
+        try:
+            status = run(col, args, summary, log)
+        finally:
+            col.close()
+    except BatchUpdateError as e:
+        _log_to_stderr("ERROR: {}".format(e))
+        summary["error"] = str(e)
+        status = EXIT_ERROR
+    except Exception as e:
+        # Anything else, such as a missing file or a locked collection, still gets a summary.
+        _log_to_stderr(traceback.format_exc())
+        summary["error"] = "{}: {}".format(type(e).__name__, e)
+        status = EXIT_ERROR
+
+    summary["status"] = {EXIT_OK: "ok", EXIT_STALE: "skipped_stale"}.get(status, "error")
+    print(json.dumps(summary, sort_keys=True))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
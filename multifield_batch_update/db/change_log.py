@@ -12,59 +12,239 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
 import os
+import queue
+import threading
 from collections import namedtuple
+from concurrent.futures import Future
 
 from anki.db import DB
 
 ChangeLogEntry = namedtuple("ChangeLogEntry", ["ts", "nid", "fld", "old", "new"])
 
+# Most rows the writer inserts in a single executemany before checking for other requests.
+WRITE_BATCH_SIZE = 1000
+
+_INSERT_SQL = """
+    insert into changelog (op, init_ts, ts, nid, fld, old, new)
+    values (?,?,?,?,?,?,?)
+"""
+
+_SELECT_COLUMNS = "op, ts, nid, fld, old, new"
+
+_shared_changelog = None
+_shared_changelog_lock = threading.Lock()
+
+
+def default_db_path():
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, "..", "user_files", "changelog.db")
+
+
+def search_query(text):
+    """Turns text typed into a search box into an FTS5 query matching changes containing all of its words.
+
+    Each word is quoted so punctuation can't be mistaken for query syntax, and a trailing * is kept
+    outside the quotes so "colo*" still matches any word starting with colo.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*") and len(word) > 1
+        if prefix:
+            word = word[:-1]
+        terms.append('"{}"{}'.format(word.replace('"', '""'), "*" if prefix else ""))
+    return " ".join(terms)
+
+
+def shared_changelog():
+    """Returns the changelog shared by everything in this process, opening it on first use."""
+    global _shared_changelog
+    with _shared_changelog_lock:
+        if _shared_changelog is None:
+            _shared_changelog = ChangeLog()
+            atexit.register(_shared_changelog.close)
+        return _shared_changelog
+
 
 class ChangeLog:
-    """Tracks changes made to notes"""
-    def __init__(self):
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        db_path = os.path.join(base_path, "..", "user_files", "changelog.db")
-        need_create = not os.path.exists(db_path)
-        self.db = DB(db_path)
-        self.db.setAutocommit(True)
-        if need_create:
-            self._create_tables()
-            self._create_indices()
-        self.db.setAutocommit(False)
-        max_id = self.db.scalar("select max(id) from changelog")
-        if max_id is not None:
-            self.next_id = max_id + 1
-        else:
-            self.next_id = 0
+    """Tracks changes made to notes
+
+    The database connection is owned by a background writer thread, so recording a change only queues
+    it and never blocks on the database.  The writer inserts queued rows in batches and commits whenever
+    it runs out of work.  Reads go through the same queue, so they see every change recorded before
+    them, and flush() waits until everything recorded so far has been committed.
+
+    The old and new values are also indexed in an FTS5 table, which the writer adds each batch of rows to
+    with a single statement, so search() finds changes by their contents without scanning the whole log.
+    Databases created before the index existed have it built the first time they are opened.  If SQLite
+    was built without FTS5, search() falls back to a scan.
+    """
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = default_db_path()
+        self.db_path = db_path
+        self.db = None
+        self._queue = queue.Queue()
+        self._closed = False
+        self._dirty = False
+        self._error = None
+        self._writer = threading.Thread(target=self._run, name="changelog-writer", daemon=True)
+        self._writer.start()
+        try:
+            self._submit(self._open)
+        except Exception:
+            # don't leave the writer thread waiting for work that will never come
+            self.close()
+            raise
 
     def close(self):
-        self.db.close()
+        if not self._closed:
+            try:
+                self._submit(self._close_db)
+            finally:
+                self._closed = True
+                self._writer.join()
 
-    def commit_changes(self):
-        self.db.commit()
-        self.db.mod = False
+    def flush(self):
+        """Blocks until every change recorded so far is committed, raising any error hit while writing it."""
+        self._submit(None)
 
     def record_change(self, op, init_ts, change):
-        self.db.execute(
-            """
-            insert into changelog (id, op, init_ts, ts, nid, fld, old, new)
-            values (?,?,?,?,?,?,?,?)
-            """, self.next_id, op, init_ts, change.ts, change.nid, change.fld,
-            change.old, change.new)
-        self.next_id += 1
+        self._check_open()
+        self._queue.put((op, init_ts, change.ts, change.nid, change.fld, change.old, change.new))
 
     def record_and_commit_changes(self, op, init_ts, changes):
-        data = []
         for change in changes:
-            data.append((self.next_id, op, init_ts, change.ts, change.nid, change.fld,
-                         change.old, change.new))
-            self.next_id += 1
-        self.db.executemany("""
-            insert into changelog (id, op, init_ts, ts, nid, fld, old, new)
-            values (?,?,?,?,?,?,?,?)
-        """, data)
-        self.commit_changes()
+            self.record_change(op, init_ts, change)
+        self.flush()
+
+    def all(self, sql, *args):
+        return self._submit(lambda: self.db.all(sql, *args))
+
+    def search(self, text, limit, offset=0):
+        """Returns (op, ts, nid, fld, old, new) for changes whose old or new value contains all the words
+        in text, newest first.  Empty text matches every change."""
+        return self._submit(lambda: self._search(text, limit, offset))
+
+    def rebuild_search_index(self):
+        """Rebuilds the search index from the changelog table, such as after editing the database by hand."""
+        self._submit(self._rebuild_search_index)
+
+    def _submit(self, fn):
+        """Runs fn on the writer thread after all changes queued before it, and returns its result."""
+        self._check_open()
+        future = Future()
+        self._queue.put((fn, future))
+        return future.result()
+
+    def _check_open(self):
+        # Once closed there is no writer thread, so anything queued would wait forever.
+        if self._closed:
+            raise RuntimeError("Changelog {} is closed".format(self.db_path))
+
+    def _run(self):
+        pending = []
+        while True:
+            item = self._queue.get()
+
+            # Drain everything already queued, so that rows are inserted and committed in batches.
+            while item is not None:
+                if len(item) == 2:
+                    # A request rather than a row, so everything queued before it must be committed first.
+                    fn, future = item
+                    closing = fn == self._close_db
+                    try:
+                        self._insert(pending)
+                        self._commit()
+                        error, self._error = self._error, None
+                        if closing:
+                            # The database is closed even if a write failed, and the error reported after.
+                            fn()
+                        if error is not None:
+                            raise error
+                        future.set_result(fn() if fn and not closing else None)
+                    except Exception as e:
+                        future.set_exception(e)
+                    if closing:
+                        return
+                else:
+                    pending.append(item)
+                    if len(pending) >= WRITE_BATCH_SIZE:
+                        self._insert(pending)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            self._insert(pending)
+            self._commit()
+
+    def _insert(self, rows):
+        """Inserts rows without committing them.  Errors are kept until the next request, since the
+        caller that recorded the rows has long since moved on."""
+        if rows:
+            try:
+                self.db.executemany(_INSERT_SQL, rows)
+                self._dirty = True
+                if self.search_indexed:
+                    self._index_new_rows()
+            except Exception as e:
+                self._error = self._error or e
+            rows.clear()
+
+    def _commit(self):
+        if self._dirty:
+            try:
+                self.db.commit()
+                self.db.mod = False
+            except Exception as e:
+                self._error = self._error or e
+            self._dirty = False
+
+    def _search(self, text, limit, offset):
+        query = search_query(text)
+        if not query:
+            return self.db.all("""
+                select {} from changelog
+                order by id desc
+                limit ? offset ?
+                """.format(_SELECT_COLUMNS), limit, offset)
+        if self.search_indexed:
+            # Ordering the FTS table by rowid pages through matches without sorting them all first.
+            return self.db.all("""
+                select {} from changelog
+                where id in (
+                  select rowid from changelog_fts
+                  where changelog_fts match ?
+                  order by rowid desc
+                  limit ? offset ?
+                )
+                order by id desc
+                """.format(_SELECT_COLUMNS), query, limit, offset)
+        words = [word.rstrip("*") for word in text.split()]
+        return self.db.all("""
+            select {} from changelog
+            where {}
+            order by id desc
+            limit ? offset ?
+            """.format(_SELECT_COLUMNS, " and ".join(["(instr(old, ?) > 0 or instr(new, ?) > 0)"] * len(words))),
+            *[word for word in words for _ in range(2)], limit, offset)
+
+    def _open(self):
+        need_create = not os.path.exists(self.db_path)
+        self.db = DB(self.db_path)
+        self.db.setAutocommit(True)
+        if need_create:
+            self._create_tables()
+            self._create_indices()
+        self.search_indexed = self._create_search_index()
+        self._indexed_id = self.db.scalar("select coalesce(max(id), 0) from changelog")
+        self.db.setAutocommit(False)
+
+    def _close_db(self):
+        if self.db is not None:
+            self.db.close()
 
     def _create_tables(self):
         self.db.executescript("""
@@ -91,3 +271,39 @@ class ChangeLog:
         self.db.executescript("""
             create index if not exists ix_changelog_ts on changelog (ts);
         """)
+
+    def _create_search_index(self):
+        """Creates the full-text index over old and new values if it doesn't exist yet, filling it from
+        any changes already logged.  Returns whether the index is available."""
+        if self.db.scalar("select count() from sqlite_master where name = 'changelog_fts'"):
+            return True
+        try:
+            self.db.executescript("""
+                create virtual table changelog_fts using fts5 (
+                  old, new, content='changelog', content_rowid='id'
+                );
+                create trigger changelog_fts_delete after delete on changelog begin
+                  insert into changelog_fts (changelog_fts, rowid, old, new)
+                  values ('delete', old.id, old.old, old.new);
+                end;
+            """)
+        except Exception:
+            # FTS5 is missing from this SQLite build
+            return False
+        self.db.execute("insert into changelog_fts (changelog_fts) values ('rebuild')")
+        return True
+
+    def _index_new_rows(self):
+        # Much faster than a trigger indexing each row as it is inserted.  Going by the last indexed id
+        # also picks up any rows left over from a batch that failed partway.
+        self.db.execute("""
+            insert into changelog_fts (rowid, old, new)
+            select id, old, new from changelog where id > ?
+            """, self._indexed_id)
+        self._indexed_id = self.db.scalar("select coalesce(max(id), 0) from changelog")
+
+    def _rebuild_search_index(self):
+        if self.search_indexed:
+            self.db.execute("insert into changelog_fts (changelog_fts) values ('rebuild')")
+            self.db.commit()
+            self._indexed_id = self.db.scalar("select coalesce(max(id), 0) from changelog")
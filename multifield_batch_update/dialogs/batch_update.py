@@ -12,81 +12,37 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import csv
-import difflib
-import html
 import os
-import time
 import traceback
-from collections import defaultdict, namedtuple
-
-from aqt.qt import (QComboBox, QDialog, QDialogButtonBox, QFileDialog, QFontDatabase, QFrame, QHBoxLayout, QLabel,
-                    QPlainTextEdit, QScrollArea, QSplitter, QStandardPaths, Qt, QVBoxLayout)
-from aqt.utils import askUser
-
-from ..db.change_log import ChangeLog, ChangeLogEntry
-
-NOTHING_VALUE = "-Nothing-"
-
-NoteChange = namedtuple("NoteChange", ["nid", "fld", "old", "new"])
-
-DIFF_PRE = """<html>
-<head>
-<style>
-p {
-    font-family: "Lucida Console", Monaco, monospace;
-}
-ins {
-    background-color: lightgreen;
-    text-decoration: none;
-}
-del {
-    background-color: lightpink;
-    text-decoration: none;
-}
-</style>
-</head>
-<body>"""
-
-DIFF_POST = """</body>
-</html>
-"""
-
-
-class BatchUpdateError(Exception):
-    """Thrown when unexpected error occurs"""
-    pass
-
-
-def html_diff(a, b):
-    sm = difflib.SequenceMatcher(None, a, b)
-    output = []
-    for opcode, a0, a1, b0, b1 in sm.get_opcodes():
-        if opcode == 'equal':
-            output.append(sm.a[a0:a1])
-        elif opcode == 'insert':
-            output.append("<ins>" + sm.b[b0:b1] + "</ins>")
-        elif opcode == 'delete':
-            output.append("<del>" + sm.a[a0:a1] + "</del>")
-        elif opcode == 'replace':
-            output.append("<del>" + sm.a[a0:a1] + "</del>")
-            output.append("<ins>" + sm.b[b0:b1] + "</ins>")
-        else:
-            raise BatchUpdateError("unexpected opcode")
-    return ''.join(output)
+
+from aqt.qt import (QCheckBox, QComboBox, QDialog, QDialogButtonBox, QFileDialog, QFontDatabase, QHBoxLayout, QLabel,
+                    QPlainTextEdit, QPushButton, QSplitter, QStackedWidget, QStandardPaths, Qt, QVBoxLayout)
+from aqt.utils import askUser, tooltip
+
+from ..batch.diff import write_html_diff
+from ..batch.plan_file import find_stale_notes, read_plan, without_notes, write_plan
+from ..batch.planner import BatchUpdateError, apply_changes, plan_jobs
+from ..batch.transforms import TransformError
+from ..db.change_log import shared_changelog
+from .file_mapping import FileMappingPanel
+
+PLAN_EXT = ".plan"
 
 
 class BatchUpdateDialog(QDialog):
     """Base class for dialogs"""
 
-    def __init__(self, browser, nids, file):
+    def __init__(self, browser, nids, files):
         super().__init__(parent=browser)
         self.browser = browser
         self.nids = nids
         self.title = "Batch Update Selected Notes"
-        self.changelog = ChangeLog()
+        self.changelog = shared_changelog()
         self.checkpoint_name = "Batch Update"
-        self.file = file
+        self.files = list(files)
+
+        # plan loaded from a file, which Diff and Update use instead of planning again
+        self.loaded_plan = None
 
         # note field names and model id
         first_note = self.browser.mw.col.getNote(self.nids[0])
@@ -94,13 +50,6 @@ class BatchUpdateDialog(QDialog):
         self.model_id = first_note.mid
         self.note_field_names = self.browser.mw.col.models.fieldNames(model)
 
-        # file field names
-        with open(self.file, encoding="utf-8") as inf:
-            reader = csv.DictReader(inf)
-
-            # load field names as list of strings
-            self.file_field_names = reader.fieldnames
-
         self._setup_ui()
 
     def _setup_ui(self):
@@ -109,113 +58,81 @@ class BatchUpdateDialog(QDialog):
         self.setMinimumHeight(400)
 
         vbox = QVBoxLayout()
-        for row in self._ui_join_keys_row():
-            vbox.addLayout(row)
-        scroll_area = QScrollArea()
-        inner = QFrame(scroll_area)
-        vbox_scrollable = QVBoxLayout()
-        inner.setLayout(vbox_scrollable)
-        for row in self._ui_field_select_rows():
-            vbox_scrollable.addLayout(row)
-        scroll_area.setWidget(inner)
+        vbox.addLayout(self._ui_files_row())
+        self.file_panels = QStackedWidget()
+        for file in self.files:
+            self.file_panels.addWidget(FileMappingPanel(file, self.note_field_names))
+        self.file_selection.currentIndexChanged.connect(self.file_panels.setCurrentIndex)
 
         splitter = QSplitter()
         splitter.setOrientation(Qt.Vertical)
-        splitter.addWidget(scroll_area)
+        splitter.addWidget(self.file_panels)
         splitter.addWidget(self._ui_log())
         vbox.addWidget(splitter)
         vbox.addLayout(self._ui_bottom_row())
 
         self.setLayout(vbox)
 
-    def _ui_join_keys_row(self):
-        def _fix_width(cb):
-            width = cb.minimumSizeHint().width()
-            cb.view().setMinimumWidth(width)
-
-        # first row consists of join keys for notes and file
+    def _ui_files_row(self):
+        # The files queued in this job.  Each has its own panel of join keys and mappings, and they
+        # are all planned together so that each note is read and written only once.
         hbox = QHBoxLayout()
         hbox.setAlignment(Qt.AlignLeft)
 
-        # file join key
-        hbox.addWidget(QLabel("File Join Key:"))
-        self.file_join_key_selection = QComboBox()
-        self.file_join_key_selection.addItems(self.file_field_names)
-        _fix_width(self.file_join_key_selection)
-        if "nid" in self.file_field_names:
-            self.file_join_key_selection.setCurrentText("nid")
-        else:
-            self.file_join_key_selection.setCurrentText(self.file_field_names[0])
-        self.file_join_key_selection.currentIndexChanged.connect(
-            lambda _: self._combobox_changed(self.file_join_key_selection))
-        hbox.addWidget(self.file_join_key_selection)
-
-        # note join key
-        hbox.addWidget(QLabel("Note Join Key:"))
-        self.note_join_key_selection = QComboBox()
-        expanded_note_field_names = ["nid"] + self.note_field_names
-        self.note_join_key_selection.addItems(expanded_note_field_names)
-        _fix_width(self.note_join_key_selection)
-        self.note_join_key_selection_default_value = "nid"
-        if self.file_join_key_selection.currentText() in expanded_note_field_names:
-            self.note_join_key_selection.setCurrentText(self.file_join_key_selection.currentText())
-        else:
-            self.note_join_key_selection.setCurrentText(self.note_join_key_selection_default_value)
-        self.note_join_key_selection.currentIndexChanged.connect(
-            lambda _: self._combobox_changed(self.note_join_key_selection))
-        hbox.addWidget(self.note_join_key_selection)
-
-        yield hbox
+        hbox.addWidget(QLabel("File:"))
+        self.file_selection = QComboBox()
+        self.file_selection.addItems([os.path.basename(file) for file in self.files])
+        hbox.addWidget(self.file_selection)
 
-        hbox = QHBoxLayout()
-        hbox.addWidget(QLabel("Define the mapping from file fields to note fields. "
-                              "Any file fields mapping to nothing will be ignored."))
-        yield hbox
+        add_file_btn = QPushButton("Add File")
+        add_file_btn.setToolTip("Queue another CSV file to update other fields of the same notes")
+        add_file_btn.clicked.connect(lambda _: self.onAddFile())
+        hbox.addWidget(add_file_btn)
 
-    def _ui_field_select_rows(self):
+        remove_file_btn = QPushButton("Remove File")
+        remove_file_btn.clicked.connect(lambda _: self.onRemoveFile())
+        hbox.addWidget(remove_file_btn)
 
-        # combo boxes to select mapping for remaining fields
-        self.mapping_field_selections = []
-        for field_name in self.file_field_names:
-            # nid can only be used as a join key
-            if field_name == "nid":
+        # whether to leave fields alone when the new value only differs in HTML formatting
+        self.ignore_equivalent_html_checkbox = QCheckBox("Ignore Formatting Changes")
+        self.ignore_equivalent_html_checkbox.setToolTip(
+            "Don't update fields whose new value renders the same, such as &nbsp; instead of a space, "
+            "<br/> instead of <br>, or a different attribute order")
+        hbox.addWidget(self.ignore_equivalent_html_checkbox)
+
+        return hbox
+
+    def onAddFile(self):
+        options = QFileDialog.Options()
+
+        # native doesn't seem to works
+        options |= QFileDialog.DontUseNativeDialog
+
+        result = QFileDialog.getOpenFileNames(
+            self, "Add CSV for Batch Update", os.path.dirname(self.files[-1]), "CSV (*.csv)",
+            options=options)
+
+        if not isinstance(result, tuple):
+            raise Exception("Expected a tuple from open dialog")
+        for file in result[0]:
+            if file in self.files:
+                tooltip("{} is already queued".format(os.path.basename(file)), parent=self)
                 continue
-            hbox = QHBoxLayout()
-            hbox.setAlignment(Qt.AlignLeft)
-            hbox.addWidget(QLabel("{} -> ".format(field_name)))
-            field_selection = QComboBox()
-            field_selection.addItems([NOTHING_VALUE] + self.note_field_names)
-            width = field_selection.minimumSizeHint().width()
-            field_selection.view().setMinimumWidth(width)
-            if field_name in self.note_field_names and \
-                    field_name != self.note_join_key_selection.currentText():
-                field_selection.setCurrentText(field_name)
-            else:
-                field_selection.setCurrentText(NOTHING_VALUE)
-            field_selection.currentIndexChanged.connect(
-                lambda _, fs=field_selection: self._combobox_changed(fs))
-            hbox.addWidget(field_selection)
-            self.mapping_field_selections.append(field_selection)
-            yield hbox
-
-    def _combobox_changed(self, updated_cb):
-        new_text = updated_cb.currentText()
-
-        # We only need to check for non-nothing values, because multiple fields can
-        # be set to nothing.
-        if new_text != NOTHING_VALUE and updated_cb is not self.file_join_key_selection:
-            # We only need to check the note mappings.  We exclude the file join key combobox.
-            note_field_combos = [self.note_join_key_selection] + self.mapping_field_selections
-
-            for cb in note_field_combos:
-                if cb is updated_cb:
-                    continue
-                else:
-                    if cb.currentText() == new_text:
-                        if cb is self.note_join_key_selection:
-                            cb.setCurrentText(self.note_join_key_selection_default_value)
-                        else:
-                            cb.setCurrentText(NOTHING_VALUE)
+            self.files.append(file)
+            self.file_panels.addWidget(FileMappingPanel(file, self.note_field_names))
+            self.file_selection.addItem(os.path.basename(file))
+            self.file_selection.setCurrentIndex(len(self.files) - 1)
+
+    def onRemoveFile(self):
+        if len(self.files) == 1:
+            tooltip("At least one file is needed", parent=self)
+            return
+        index = self.file_selection.currentIndex()
+        panel = self.file_panels.widget(index)
+        del self.files[index]
+        self.file_panels.removeWidget(panel)
+        panel.deleteLater()
+        self.file_selection.removeItem(index)
 
     def _ui_log(self):
         self.log = QPlainTextEdit()
@@ -250,6 +167,18 @@ class BatchUpdateDialog(QDialog):
         fix_btn.setToolTip("Update")
         fix_btn.clicked.connect(lambda _: self.onCheck(mode="update"))
 
+        # Button to save the proposed changes so they can be reviewed and applied later
+        save_plan_btn = buttons.addButton("&Save Plan",
+                                          QDialogButtonBox.ActionRole)
+        save_plan_btn.setToolTip("Save the proposed changes to a plan file")
+        save_plan_btn.clicked.connect(lambda _: self.onCheck(mode="plan"))
+
+        # Button to load a saved plan for Diff and Update to use
+        load_plan_btn = buttons.addButton("&Load Plan",
+                                          QDialogButtonBox.ActionRole)
+        load_plan_btn.setToolTip("Load a plan file for Diff and Update to use instead of the CSV file")
+        load_plan_btn.clicked.connect(lambda _: self.onLoadPlan())
+
         # Button to close this dialog
         close_btn = buttons.addButton("&Close",
                                       QDialogButtonBox.RejectRole)
@@ -258,195 +187,127 @@ class BatchUpdateDialog(QDialog):
         hbox.addWidget(buttons)
         return hbox
 
-    def onCheck(self, *, mode):
+    def _make_plan(self):
+        jobs = []
+        for index, file in enumerate(self.files):
+            if len(self.files) > 1:
+                self.log.appendPlainText("File {}:".format(file))
+            jobs.append(self.file_panels.widget(index).job(self.log.appendPlainText))
+
+        return plan_jobs(
+            self.browser.mw.col, self.nids, jobs,
+            ignore_equivalent_html=self.ignore_equivalent_html_checkbox.isChecked(),
+            log=self.log.appendPlainText)
+
+    def _validate_loaded_plan(self):
+        path, header, plan = self.loaded_plan
+        self.log.appendPlainText("Using plan loaded from {}".format(path))
+        model_id = header.get("model_id")
+        if model_id is not None and model_id != self.model_id:
+            raise BatchUpdateError("Plan was made for note type {}, but the selected notes have note type {}".format(
+                model_id, self.model_id))
+        unselected = set(plan.note_changes.nids()) - set(self.nids)
+        if unselected:
+            raise BatchUpdateError("Plan changes {} notes that are not selected".format(len(unselected)))
+
+        changed, missing = find_stale_notes(self.browser.mw.col, plan.note_changes.notes())
+        if changed:
+            self.log.appendPlainText("Skipping {} notes modified since the plan was made: {}".format(
+                len(changed), ", ".join(str(nid) for nid in sorted(changed))))
+        if missing:
+            self.log.appendPlainText("Skipping {} notes deleted since the plan was made: {}".format(
+                len(missing), ", ".join(str(nid) for nid in sorted(missing))))
+        if changed or missing:
+            plan = without_notes(plan, changed | missing)
+        if plan.note_changes:
+            self.log.appendPlainText("Need to make changes to {} notes".format(len(plan.note_changes)))
+        return plan
+
+    def _ask_save_path(self, title, name, ext, file_type):
+        default_path = QStandardPaths.writableLocation(QStandardPaths.DocumentsLocation)
+        path = os.path.join(default_path, f"{name}{ext}")
+
+        options = QFileDialog.Options()
+
+        # native doesn't seem to works
+        options |= QFileDialog.DontUseNativeDialog
+
+        # we'll confirm ourselves
+        options |= QFileDialog.DontConfirmOverwrite
+
+        result = QFileDialog.getSaveFileName(
+            self, title, path, f"{file_type} (*{ext})",
+            options=options)
+
+        if not isinstance(result, tuple):
+            raise Exception("Expected a tuple from save dialog")
+        file = result[0]
+        if file:
+            if not file.lower().endswith(ext):
+                file += ext
+            if os.path.exists(file):
+                if not askUser("{} already exists. Are you sure you want to overwrite it?".format(file),
+                               parent=self):
+                    return None
+            return file
+        return None
+
+    def onLoadPlan(self):
         self.log.clear()
         try:
-            # Mapping from field name in file to field combo boxes for notes.
-            # We need to check each of the selections for the combo boxes.
-            zipped_fields = zip(
-                [fn for fn in self.file_field_names if fn != "nid"],
-                self.mapping_field_selections)
-
-            # mapping from file join key name to note join key name
-            file_join_key_name = self.file_join_key_selection.currentText()
-            note_join_key_name = self.note_join_key_selection.currentText()
-
-            self.log.appendPlainText("Join key: File field '{}' -> Note field '{}'".format(
-                file_join_key_name, note_join_key_name))
-
-            # Check which of the field combo boxes having a non-nothing selection and
-            # build the mapping from fields in file to fields in notes.
-            file_to_note_mappings = {}
-            for file_field_name, note_field_cb in zipped_fields:
-                note_field_name = note_field_cb.currentText()
-                if note_field_name != NOTHING_VALUE:
-                    file_to_note_mappings[file_field_name] = note_field_name
-                    self.log.appendPlainText("File field '{}' -> Note field '{}'".format(
-                        file_field_name, note_field_name))
-            if not file_to_note_mappings:
-                self.log.appendPlainText("ERROR: No mappings selected")
-                return
-
-            # Check which key values exist and to make sure there are no duplicate values.
-            # Build a mapping form these key values to the row which contains the field values.
-            file_key_to_values = {}
-            duplicate_file_key_values = set()
-            with open(self.file, encoding="utf-8") as inf:
-                reader = csv.DictReader(inf)
-                for row in reader:
-                    join_key_val = row[file_join_key_name]
-                    if join_key_val in file_key_to_values:
-                        duplicate_file_key_values.add(join_key_val)
-                    else:
-                        file_key_to_values[join_key_val] = row
-            if duplicate_file_key_values:
-                self.log.appendPlainText("ERROR: Found {} key values for '{}' that appear more than once:".format(
-                    len(duplicate_file_key_values), file_join_key_name))
-                for val in duplicate_file_key_values:
-                    self.log.appendPlainText(val)
-                return
-            self.log.appendPlainText("Found {} records for '{}' in {}".format(
-                len(file_key_to_values), file_join_key_name, self.file))
-
-            # When we aren't joining by nid, we need to create an additional mapping from the join
-            # key to the nid value, because we can only look up by nid.
-            note_join_key_to_nid = {}
-            if note_join_key_name != "nid":
-                self.log.appendPlainText("Joining to notes by '{}', so finding all values.".format(
-                    note_join_key_name))
-                for nid in self.nids:
-                    note = self.browser.mw.col.getNote(nid)
-                    if note.mid != self.model_id:
-                        self.log.appendPlainText(
-                            "ERROR: Note {} has different model ID {} than expected {} based on first note. ".format(
-                                nid, note.mid, self.model_id) + "Please only select notes of the same model.")
-                        return
-                    if note_join_key_name in note:
-                        if note[note_join_key_name] in note_join_key_to_nid:
-                            self.log.appendPlainText("ERROR: Value '{}' already exists in notes".format(
-                                note[note_join_key_name]))
-                            return
-                        else:
-                            note_join_key_to_nid[note[note_join_key_name]] = nid
-                    else:
-                        self.log.appendPlainText("ERROR: Field '{}' not found in note {}".format(
-                            note_join_key_name, nid))
-                        return
-
-            # these store the changes we will propose to make (grouped by nid)
-            note_changes = defaultdict(list)
-
-            # track join keys that were not found in notes
-            missing_note_keys = set()
-
-            # how many fields being updated are empty
-            empty_note_field_count = 0
-            notes_with_empty_fields = set()
-
-            for file_key, file_values in file_key_to_values.items():
-
-                if note_join_key_name == "nid":
-                    nid = file_key
-                else:
-                    if file_key in note_join_key_to_nid:
-                        nid = note_join_key_to_nid[file_key]
-                        self.log.appendPlainText("Found note {} with value {} for '{}'".format(
-                            nid, file_key, note_join_key_name))
-                    else:
-                        self.log.appendPlainText("Could not find note with value {} for '{}'".format(
-                            file_key, note_join_key_name))
-                        missing_note_keys.add(file_key)
-                        continue
-
-                self.log.appendPlainText("Checking note {}".format(nid))
-
-                try:
-                    note = self.browser.mw.col.getNote(nid)
-                except TypeError:
-                    self.log.appendPlainText("ERROR: Note {} was not found".format(nid))
-                    return
+            default_path = QStandardPaths.writableLocation(QStandardPaths.DocumentsLocation)
+
+            options = QFileDialog.Options()
+
+            # native doesn't seem to works
+            options |= QFileDialog.DontUseNativeDialog
+
+            result = QFileDialog.getOpenFileName(
+                self, "Load Plan", default_path, f"Plan (*{PLAN_EXT})",
+                options=options)
+
+            if not isinstance(result, tuple):
+                raise Exception("Expected a tuple from open dialog")
+            file = result[0]
+            if file:
+                header, plan = read_plan(file)
+                self.loaded_plan = (file, header, plan)
+                self.log.appendPlainText("Loaded plan for {} notes from {}".format(len(plan.note_changes), file))
+                self.log.appendPlainText("Plan was made from {}".format(header.get("file")))
+                self.log.appendPlainText("Diff and Update will use this plan until Dry-run or Save Plan is used")
+        except BatchUpdateError as e:
+            self.log.appendPlainText("ERROR: {}".format(e))
+        except Exception:
+            self.log.appendPlainText("Failed while loading plan:\n{}".format(traceback.format_exc()))
+        finally:
+            self.log.repaint()
 
-                # Get the current values for fields we're updating in the note.
-                note_values = {}
-                for note_field_name in file_to_note_mappings.values():
-                    if note_field_name in note:
-                        note_values[note_field_name] = note[note_field_name]
-                    else:
-                        self.log.appendPlainText("ERROR: Field '{}' not found in note {}".format(
-                            note_field_name, nid))
-                        return
-
-                # Compare the file field values to the note field values and see if anything is different
-                # and therefore needs to be updated.
-                for file_field_name, note_field_name in file_to_note_mappings.items():
-                    file_value = file_values[file_field_name]
-                    note_value = note_values[note_field_name]
-                    if file_value != note_value:
-                        self.log.appendPlainText("Need to update note field '{}':".format(note_field_name))
-                        self.log.appendPlainText("{}\n=>\n{}".format(
-                            note_value or "<empty>", file_value))
-                        note_changes[nid].append(NoteChange(nid=nid, fld=note_field_name,
-                                                            old=note_value, new=file_value))
-                        if not note_value:
-                            empty_note_field_count += 1
-                            notes_with_empty_fields.add(nid)
-
-            if missing_note_keys:
-                self.log.appendPlainText("ERROR: {} values were not found in notes for field '{}'".format(
-                    len(missing_note_keys), note_join_key_name))
-                return
+    def onCheck(self, *, mode):
+        self.log.clear()
+        try:
+            if self.loaded_plan is not None and mode in ("diff", "update"):
+                plan = self._validate_loaded_plan()
+            else:
+                self.loaded_plan = None
+                plan = self._make_plan()
+            note_changes = plan.note_changes
 
             if note_changes:
-                self.log.appendPlainText("Need to make changes to {} notes".format(
-                    len(note_changes)))
-                if empty_note_field_count:
-                    self.log.appendPlainText("{} fields across {} notes are empty".format(
-                        empty_note_field_count, len(notes_with_empty_fields)))
-
                 if mode == "dryrun":
                     # nothing to do
                     pass
+                elif mode == "plan":
+                    file = self._ask_save_path("Save Plan", "changes", PLAN_EXT, "Plan")
+                    if file:
+                        self.log.appendPlainText("Saving to {}".format(file))
+                        write_plan(file, plan, file=", ".join(self.files), model_id=self.model_id)
+                        self.log.appendPlainText("Done")
                 elif mode == "diff":
-                    ext = ".html"
-                    default_path = QStandardPaths.writableLocation(QStandardPaths.DocumentsLocation)
-                    path = os.path.join(default_path, f"diff{ext}")
-
-                    options = QFileDialog.Options()
-
-                    # native doesn't seem to works
-                    options |= QFileDialog.DontUseNativeDialog
-
-                    # we'll confirm ourselves
-                    options |= QFileDialog.DontConfirmOverwrite
-
-                    result = QFileDialog.getSaveFileName(
-                        self, "Save HTML diff", path, f"HTML (*{ext})",
-                        options=options)
-
-                    if not isinstance(result, tuple):
-                        raise Exception("Expected a tuple from save dialog")
-                    file = result[0]
+                    file = self._ask_save_path("Save HTML diff", "diff", ".html", "HTML")
                     if file:
-                        do_save = True
-                        if not file.lower().endswith(ext):
-                            file += ext
-                        if os.path.exists(file):
-                            if not askUser("{} already exists. Are you sure you want to overwrite it?".format(file),
-                                           parent=self):
-                                do_save = False
-                        if do_save:
-                            self.log.appendPlainText("Saving to {}".format(file))
-                            with open(file, "w", encoding="utf-8") as outf:
-                                outf.write(DIFF_PRE)
-                                for nid, changes in note_changes.items():
-                                    outf.write("<p>nid {}:</p>\n".format(nid))
-                                    for change in changes:
-                                        outf.write("<p>{}: {}</p>\n".format(
-                                            change.fld,
-                                            html_diff(html.escape(change.old),
-                                                      html.escape(change.new))))
-                                outf.write(DIFF_POST)
-                            self.log.appendPlainText("Done")
+                        self.log.appendPlainText("Saving to {}".format(file))
+                        write_html_diff(file, note_changes)
+                        self.log.appendPlainText("Done")
                 elif mode == "update":
                     if askUser("{} notes will be updated.  Are you sure you want to do this?".format(
                             len(note_changes)), parent=self):
@@ -456,41 +317,29 @@ class BatchUpdateDialog(QDialog):
                             self.checkpoint_name, len(note_changes),
                             "notes" if len(note_changes) > 1 else "note"))
                         self.browser.model.beginReset()
-                        updated_count = 0
                         try:
-                            init_ts = int(time.time() * 1000)
-
-                            for nid, changes in note_changes.items():
-                                note = self.browser.mw.col.getNote(nid)
-                                for change in changes:
-                                    ts = int(time.time() * 1000)
-                                    note[change.fld] = change.new
-                                    self.changelog.record_change(
-                                        "batch_update", init_ts,
-                                        ChangeLogEntry(
-                                            ts=ts, nid=nid, fld=change.fld,
-                                            old=change.old, new=change.new))
-                                note.flush()
-                                updated_count += 1
+                            updated_count = apply_changes(self.browser.mw.col, note_changes, self.changelog)
                             self.log.appendPlainText("Updated {} notes".format(updated_count))
                         finally:
-                            if updated_count:
-                                self.changelog.commit_changes()
-                                self.browser.mw.requireReset()
+                            self.browser.mw.requireReset()
                             self.browser.model.endReset()
+                            if self.loaded_plan is not None:
+                                # The plan's notes have all changed now, so it can't be used again.
+                                self.loaded_plan[2].note_changes.close()
+                                self.loaded_plan = None
+                                note_changes.close()
                 else:
                     self.log.appendPlainText("ERROR: Unexpected mode: {}".format(mode))
                     return
             else:
                 self.log.appendPlainText("No changes need to be made")
 
+        except (BatchUpdateError, TransformError) as e:
+            self.log.appendPlainText("ERROR: {}".format(e))
+
         except Exception:
             self.log.appendPlainText("Failed during dry run:\n{}".format(traceback.format_exc()))
 
         finally:
             # Ensure QPlainTextEdit refreshes (not clear why this is necessary)
             self.log.repaint()
-
-    def close(self):
-        self.changelog.close()
-        super().close()
@@ -17,11 +17,11 @@ import datetime
 import os
 import traceback
 
-from aqt.qt import (QDialog, QDialogButtonBox, QFileDialog, QFontDatabase, QHBoxLayout, QLabel, QPlainTextEdit,
-                    QStandardPaths, Qt, QVBoxLayout)
+from aqt.qt import (QDialog, QDialogButtonBox, QFileDialog, QFontDatabase, QHBoxLayout, QLabel, QLineEdit,
+                    QPlainTextEdit, QPushButton, QStandardPaths, Qt, QVBoxLayout)
 from aqt.utils import askUser, tooltip
 
-from ..db.change_log import ChangeLog
+from ..db.change_log import shared_changelog
 
 
 class ChangeLogDialog(QDialog):
@@ -30,8 +30,11 @@ class ChangeLogDialog(QDialog):
     def __init__(self, browser):
         super().__init__(parent=browser)
         self.browser = browser
-        self.changelog = ChangeLog()
+        self.changelog = shared_changelog()
         self.display_limit = 500
+        # the search shown and how many of its newest matches precede the current page
+        self.search_text = ""
+        self.offset = 0
         self._setup_ui()
 
     def _setup_ui(self):
@@ -50,7 +53,28 @@ class ChangeLogDialog(QDialog):
 
     def _ui_top_row(self):
         hbox = QHBoxLayout()
-        hbox.addWidget(QLabel("Last {} updates".format(self.display_limit)))
+
+        hbox.addWidget(QLabel("Search:"))
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("Words in the old or new value, such as colo* to match prefixes")
+        self.search_box.returnPressed.connect(self.onSearch)
+        hbox.addWidget(self.search_box)
+
+        search_btn = QPushButton("Search")
+        search_btn.clicked.connect(lambda _: self.onSearch())
+        hbox.addWidget(search_btn)
+
+        self.page_label = QLabel()
+        hbox.addWidget(self.page_label)
+
+        self.newer_btn = QPushButton("< Newer")
+        self.newer_btn.clicked.connect(lambda _: self.onPage(-1))
+        hbox.addWidget(self.newer_btn)
+
+        self.older_btn = QPushButton("Older >")
+        self.older_btn.clicked.connect(lambda _: self.onPage(1))
+        hbox.addWidget(self.older_btn)
+
         return hbox
 
     def _ui_log(self):
@@ -80,15 +104,35 @@ class ChangeLogDialog(QDialog):
         hbox.addWidget(buttons)
         return hbox
 
+    def onSearch(self):
+        self.search_text = self.search_box.text().strip()
+        self.offset = 0
+        self.fillLog()
+
+    def onPage(self, direction):
+        self.offset = max(0, self.offset + direction * self.display_limit)
+        self.fillLog()
+
     def fillLog(self):
+        self.log.clear()
         append_to_log = self.log.appendPlainText
-        self.has_records = False
-        for rec in reversed(self.changelog.db.all("""
-                select op, ts, nid, fld, old, new from changelog
-                order by ts desc
-                limit {}
-                """.format(self.display_limit))):
-            self.has_records = True
+
+        # fetch one extra record to know whether there is an older page
+        recs = self.changelog.search(self.search_text, self.display_limit + 1, self.offset)
+        has_older = len(recs) > self.display_limit
+        recs = recs[:self.display_limit]
+        if not self.search_text and self.offset == 0:
+            self.has_records = bool(recs)
+
+        if recs:
+            self.page_label.setText("{} updates {}-{}".format(
+                "Matching" if self.search_text else "Last", self.offset + 1, self.offset + len(recs)))
+        else:
+            self.page_label.setText("No matching updates" if self.search_text else "No updates")
+        self.newer_btn.setEnabled(self.offset > 0)
+        self.older_btn.setEnabled(has_older)
+
+        for rec in reversed(recs):
             op, ts, nid, fld, old, new = rec
             dt = datetime.datetime.utcfromtimestamp(ts / 1000)
             ts_formatted = dt.strftime("%Y-%m-%dT%H:%M:%S")
@@ -140,7 +184,7 @@ class ChangeLogDialog(QDialog):
                         field_names = ["ts", "op", "nid", "fld", "old", "new"]
                         writer = csv.DictWriter(outf, fieldnames=field_names)
                         writer.writeheader()
-                        for rec in self.changelog.db.all("""
+                        for rec in self.changelog.all("""
                                 select op, ts, nid, fld, old, new from changelog
                                 order by ts asc
                                 """):
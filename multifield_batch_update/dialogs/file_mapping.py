@@ -0,0 +1,240 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from aqt.qt import (QAbstractItemView, QCheckBox, QComboBox, QHBoxLayout, QHeaderView, QLabel, QLineEdit, QPushButton,
+                    QSortFilterProxyModel, Qt, QTableView, QVBoxLayout, QWidget)
+
+from ..batch.planner import FieldMapping, FileJob, read_file_field_names
+from ..batch.transforms import TRANSFORM_KINDS, compile_transform, describe_transform
+from ..text.html import normalize_key
+from .mapping_model import (FILE_COLUMN, NOTE_FIELD_COLUMN, NOTHING_VALUE, TRANSFORM_COLUMN, ComboBoxDelegate,
+                            MappingModel)
+
+
+class FileMappingPanel(QWidget):
+    """Join keys and field mappings for one CSV file"""
+
+    def __init__(self, file, note_field_names, parent=None):
+        super().__init__(parent)
+        self.file = file
+        self.note_field_names = note_field_names
+
+        # file field names
+        self.file_field_names = read_file_field_names(self.file)
+
+        # additional (row widget, file key selection, note key selection) making up a composite join key
+        self.extra_join_keys = []
+
+        self._setup_ui()
+
+    def _setup_ui(self):
+        vbox = QVBoxLayout()
+        vbox.setContentsMargins(0, 0, 0, 0)
+        for row in self._ui_join_keys_row():
+            vbox.addLayout(row)
+        vbox.addWidget(self._ui_mapping_table())
+
+        self.setLayout(vbox)
+
+    @staticmethod
+    def _fix_width(cb):
+        width = cb.minimumSizeHint().width()
+        cb.view().setMinimumWidth(width)
+
+    def _ui_join_keys_row(self):
+        # first row consists of join keys for notes and file
+        hbox = QHBoxLayout()
+        hbox.setAlignment(Qt.AlignLeft)
+
+        # file join key
+        hbox.addWidget(QLabel("File Join Key:"))
+        self.file_join_key_selection = QComboBox()
+        self.file_join_key_selection.addItems(self.file_field_names)
+        self._fix_width(self.file_join_key_selection)
+        if "nid" in self.file_field_names:
+            self.file_join_key_selection.setCurrentText("nid")
+        else:
+            self.file_join_key_selection.setCurrentText(self.file_field_names[0])
+        hbox.addWidget(self.file_join_key_selection)
+
+        # note join key
+        hbox.addWidget(QLabel("Note Join Key:"))
+        self.note_join_key_selection = QComboBox()
+        expanded_note_field_names = ["nid"] + self.note_field_names
+        self.note_join_key_selection.addItems(expanded_note_field_names)
+        self._fix_width(self.note_join_key_selection)
+        self.note_join_key_selection_default_value = "nid"
+        if self.file_join_key_selection.currentText() in expanded_note_field_names:
+            self.note_join_key_selection.setCurrentText(self.file_join_key_selection.currentText())
+        else:
+            self.note_join_key_selection.setCurrentText(self.note_join_key_selection_default_value)
+        self.note_join_key_selection.currentIndexChanged.connect(lambda _: self._update_note_join_keys())
+        hbox.addWidget(self.note_join_key_selection)
+
+        # further fields to join on, for files where no single column identifies a note
+        add_key_button = QPushButton("Add Key")
+        add_key_button.setToolTip("Join on a combination of fields, all of which must match")
+        add_key_button.clicked.connect(self.onAddJoinKey)
+        hbox.addWidget(add_key_button)
+
+        # whether to compare join keys after stripping HTML, whitespace and case
+        self.normalize_keys_checkbox = QCheckBox("Normalize Keys")
+        self.normalize_keys_checkbox.setToolTip(
+            "Strip HTML, unescape entities, collapse whitespace and ignore case when joining on a note field")
+        hbox.addWidget(self.normalize_keys_checkbox)
+
+        yield hbox
+
+        self.extra_join_keys_layout = QVBoxLayout()
+        yield self.extra_join_keys_layout
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(QLabel("Define the mapping from file fields to note fields. "
+                              "Any file fields mapping to nothing will be ignored.\n"
+                              "Optionally transform the value with a template referring to {{Column}} names, "
+                              "a regex replacement, or by appending/prepending to the existing note value."))
+        yield hbox
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(QLabel("Filter:"))
+        self.mapping_filter = QLineEdit()
+        self.mapping_filter.setPlaceholderText("Show only file fields containing this text")
+        hbox.addWidget(self.mapping_filter)
+        yield hbox
+
+    def _ui_mapping_table(self):
+        # The mapping is shown as a table over a model rather than a row of widgets per column, so only
+        # the visible rows are drawn and combo boxes only exist while a cell is being edited.  This keeps
+        # the dialog responsive for files with thousands of columns.
+        self.mapping_model = MappingModel(self.file_field_names, self.note_field_names, self)
+        self.mapping_model.automap(self._note_join_key_names())
+        self.mapping_model.noteJoinKeyTaken.connect(self._onNoteJoinKeyTaken)
+
+        proxy = QSortFilterProxyModel(self)
+        proxy.setSourceModel(self.mapping_model)
+        proxy.setFilterKeyColumn(FILE_COLUMN)
+        proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.mapping_filter.textChanged.connect(proxy.setFilterFixedString)
+
+        table = QTableView()
+        table.setModel(proxy)
+        table.setItemDelegateForColumn(
+            NOTE_FIELD_COLUMN, ComboBoxDelegate([NOTHING_VALUE] + self.note_field_names, table))
+        table.setItemDelegateForColumn(TRANSFORM_COLUMN, ComboBoxDelegate(TRANSFORM_KINDS, table))
+        table.setEditTriggers(QAbstractItemView.AllEditTriggers)
+        table.setSelectionMode(QAbstractItemView.SingleSelection)
+        table.verticalHeader().hide()
+        table.verticalHeader().setDefaultSectionSize(table.fontMetrics().height() + 10)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        table.horizontalHeader().setStretchLastSection(True)
+        table.setWordWrap(False)
+        self.mapping_table = table
+        return table
+
+    def onAddJoinKey(self):
+        widget = QWidget()
+        hbox = QHBoxLayout()
+        hbox.setContentsMargins(0, 0, 0, 0)
+        hbox.setAlignment(Qt.AlignLeft)
+
+        hbox.addWidget(QLabel("And File Field:"))
+        file_join_key_selection = QComboBox()
+        file_join_key_selection.addItems(self.file_field_names)
+        self._fix_width(file_join_key_selection)
+        hbox.addWidget(file_join_key_selection)
+
+        # nid already identifies a note, so it can't be part of a composite key
+        hbox.addWidget(QLabel("Note Field:"))
+        note_join_key_selection = QComboBox()
+        note_join_key_selection.addItems(self.note_field_names)
+        self._fix_width(note_join_key_selection)
+        if file_join_key_selection.currentText() in self.note_field_names:
+            note_join_key_selection.setCurrentText(file_join_key_selection.currentText())
+        note_join_key_selection.currentIndexChanged.connect(lambda _: self._update_note_join_keys())
+        hbox.addWidget(note_join_key_selection)
+
+        remove_button = QPushButton("Remove")
+        hbox.addWidget(remove_button)
+
+        widget.setLayout(hbox)
+        extra_join_key = (widget, file_join_key_selection, note_join_key_selection)
+        remove_button.clicked.connect(lambda: self._remove_join_key(extra_join_key))
+        self.extra_join_keys.append(extra_join_key)
+        self.extra_join_keys_layout.addWidget(widget)
+        self._update_note_join_keys()
+
+    def _remove_join_key(self, extra_join_key):
+        self.extra_join_keys.remove(extra_join_key)
+        extra_join_key[0].deleteLater()
+        self._update_note_join_keys()
+
+    def _file_join_key_names(self):
+        return [self.file_join_key_selection.currentText()] + [
+            file_cb.currentText() for _, file_cb, _ in self.extra_join_keys]
+
+    def _note_join_key_names(self):
+        return [self.note_join_key_selection.currentText()] + [
+            note_cb.currentText() for _, _, note_cb in self.extra_join_keys]
+
+    def _update_note_join_keys(self):
+        self.mapping_model.set_note_join_keys(self._note_join_key_names())
+
+    def _onNoteJoinKeyTaken(self, note_field):
+        # the column mapping wins, so drop the field from the join key
+        for extra_join_key in self.extra_join_keys:
+            if extra_join_key[2].currentText() == note_field:
+                self._remove_join_key(extra_join_key)
+                return
+        if self.extra_join_keys:
+            # nid can't be combined with other fields, so the next key field takes the primary key's place
+            extra_join_key = self.extra_join_keys[0]
+            self.file_join_key_selection.setCurrentText(extra_join_key[1].currentText())
+            self.note_join_key_selection.setCurrentText(extra_join_key[2].currentText())
+            self._remove_join_key(extra_join_key)
+        else:
+            self.note_join_key_selection.setCurrentText(self.note_join_key_selection_default_value)
+
+    def job(self, log):
+        """Builds the FileJob for the current selections, logging them as it goes.
+
+        Transforms are compiled here once, so applying them to each row only does the per-value work.
+        Raises TransformError if a transform is invalid.
+        """
+        # mapping from file join key name to note join key name, as tuples of names for a composite key
+        file_join_key_names = self._file_join_key_names()
+        note_join_key_names = self._note_join_key_names()
+
+        log("Join key: File field '{}' -> Note field '{}'".format(
+            " + ".join(file_join_key_names), " + ".join(note_join_key_names)))
+
+        if len(file_join_key_names) == 1:
+            file_join_key_name, note_join_key_name = file_join_key_names[0], note_join_key_names[0]
+        else:
+            file_join_key_name, note_join_key_name = tuple(file_join_key_names), tuple(note_join_key_names)
+
+        # Normalization only makes sense for note fields, as nid values are plain integers.
+        normalize = None
+        if self.normalize_keys_checkbox.isChecked() and "nid" not in note_join_key_names:
+            normalize = normalize_key
+            log("Normalizing join key values")
+
+        # build the mapping from fields in file to fields in notes
+        mappings = []
+        for file_field_name, note_field_name, kind, arg1, arg2 in self.mapping_model.mappings():
+            transform = compile_transform(kind, file_field_name, arg1, arg2, self.file_field_names)
+            mappings.append(FieldMapping(file_field_name, note_field_name, transform))
+            log("File field '{}' -> Note field '{}'{}".format(
+                file_field_name, note_field_name, describe_transform(kind, arg1, arg2)))
+
+        return FileJob(self.file, file_join_key_name, note_join_key_name, mappings, normalize)
@@ -0,0 +1,185 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from aqt.qt import QAbstractTableModel, QComboBox, QModelIndex, QStyledItemDelegate, Qt, pyqtSignal
+
+from ..batch.transforms import TRANSFORM_ARGS, VALUE
+
+NOTHING_VALUE = "-Nothing-"
+
+FILE_COLUMN = 0
+NOTE_FIELD_COLUMN = 1
+TRANSFORM_COLUMN = 2
+ARG1_COLUMN = 3
+ARG2_COLUMN = 4
+
+HEADERS = ["File Field", "Note Field", "Transform", "Argument 1", "Argument 2"]
+
+
+class MappingModel(QAbstractTableModel):
+    """Table of file columns and the note field and transform each one maps to.
+
+    A reverse index from note field to row keeps each note field mapped from at most one column, so
+    changing a mapping never has to scan the other rows, however many columns the file has.
+    """
+
+    # Emitted with the note field when a column is mapped to a field currently used in the note join key.
+    noteJoinKeyTaken = pyqtSignal(str)
+
+    def __init__(self, file_field_names, note_field_names, parent=None):
+        super().__init__(parent)
+        # nid can only be used as a join key
+        self.file_field_names = [name for name in file_field_names if name != "nid"]
+        self.note_field_names = note_field_names
+        self.note_fields = [None] * len(self.file_field_names)
+        self.transforms = [(VALUE, "", "")] * len(self.file_field_names)
+        self.note_field_to_row = {}
+        self.note_join_keys = set()
+
+    def automap(self, note_join_keys):
+        """Maps each file column to the note field with the same name, other than the join key fields."""
+        self.beginResetModel()
+        self.note_join_keys = set(note_join_keys)
+        note_field_names = set(self.note_field_names)
+        self.note_fields = [None] * len(self.file_field_names)
+        self.note_field_to_row = {}
+        for row, name in enumerate(self.file_field_names):
+            if name in note_field_names and name not in self.note_join_keys:
+                self.note_fields[row] = name
+                self.note_field_to_row[name] = row
+        self.endResetModel()
+
+    def set_note_join_keys(self, note_join_keys):
+        """Records the note join key fields, clearing any column mapped to them since a field can't be both."""
+        self.note_join_keys = set(note_join_keys)
+        for note_join_key in self.note_join_keys:
+            self._clear_note_field(note_join_key)
+
+    def _clear_note_field(self, note_field, keep_row=None):
+        row = self.note_field_to_row.get(note_field)
+        if row is not None and row != keep_row:
+            del self.note_field_to_row[note_field]
+            self.note_fields[row] = None
+            index = self.index(row, NOTE_FIELD_COLUMN)
+            self.dataChanged.emit(index, index)
+
+    def mappings(self):
+        """Yields (file field, note field, transform kind, arg1, arg2) for each mapped column."""
+        for name, note_field, transform in zip(self.file_field_names, self.note_fields, self.transforms):
+            if note_field is not None:
+                yield (name, note_field) + transform
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.file_field_names)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return None
+
+    def _arg_placeholder(self, row, column):
+        kind = self.transforms[row][0]
+        return TRANSFORM_ARGS[kind][column - ARG1_COLUMN]
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        column = index.column()
+        if column in (NOTE_FIELD_COLUMN, TRANSFORM_COLUMN):
+            flags |= Qt.ItemIsEditable
+        elif column in (ARG1_COLUMN, ARG2_COLUMN):
+            if self._arg_placeholder(index.row(), column) is not None:
+                flags |= Qt.ItemIsEditable
+            else:
+                flags = Qt.NoItemFlags
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            if column == FILE_COLUMN:
+                return self.file_field_names[row]
+            elif column == NOTE_FIELD_COLUMN:
+                return self.note_fields[row] or NOTHING_VALUE
+            elif column == TRANSFORM_COLUMN:
+                return self.transforms[row][0]
+            else:
+                return self.transforms[row][column - TRANSFORM_COLUMN]
+        elif role == Qt.ToolTipRole and column in (ARG1_COLUMN, ARG2_COLUMN):
+            return self._arg_placeholder(row, column)
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        row, column = index.row(), index.column()
+        if column == NOTE_FIELD_COLUMN:
+            note_field = None if value == NOTHING_VALUE else value
+            old_note_field = self.note_fields[row]
+            if note_field == old_note_field:
+                return False
+            if old_note_field is not None:
+                del self.note_field_to_row[old_note_field]
+            if note_field is not None:
+                self._clear_note_field(note_field, keep_row=row)
+                self.note_field_to_row[note_field] = row
+            self.note_fields[row] = note_field
+            self.dataChanged.emit(index, index)
+            if note_field is not None and note_field in self.note_join_keys:
+                self.noteJoinKeyTaken.emit(note_field)
+            return True
+        elif column == TRANSFORM_COLUMN:
+            kind, arg1, arg2 = self.transforms[row]
+            if value == kind:
+                return False
+            # clear arguments the new kind of transform doesn't use
+            placeholder1, placeholder2 = TRANSFORM_ARGS[value]
+            self.transforms[row] = (value, arg1 if placeholder1 is not None else "",
+                                    arg2 if placeholder2 is not None else "")
+            self.dataChanged.emit(index, self.index(row, ARG2_COLUMN))
+            return True
+        elif column in (ARG1_COLUMN, ARG2_COLUMN):
+            transform = list(self.transforms[row])
+            transform[column - TRANSFORM_COLUMN] = value
+            self.transforms[row] = tuple(transform)
+            self.dataChanged.emit(index, index)
+            return True
+        return False
+
+
+class ComboBoxDelegate(QStyledItemDelegate):
+    """Edits a cell with a combo box, only created while the cell is being edited"""
+
+    def __init__(self, items, parent=None):
+        super().__init__(parent)
+        self.items = items
+
+    def createEditor(self, parent, option, index):
+        editor = QComboBox(parent)
+        editor.addItems(self.items)
+        # commit as soon as a value is picked rather than when focus leaves the cell
+        editor.activated.connect(lambda _: self.commitData.emit(editor))
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentText(index.data(Qt.EditRole))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText(), Qt.EditRole)
@@ -18,8 +18,9 @@ from anki.hooks import addHook
 from aqt.qt import QFileDialog, QStandardPaths
 from aqt.utils import tooltip
 
-from .dialogs.batch_update import BatchUpdateDialog
-from .dialogs.change_log import ChangeLogDialog
+# The dialogs, and the diff, CSV and changelog modules they depend on, are imported the first time a
+# menu action is used rather than here.  This module is loaded every time Anki starts, so it should
+# only register the menu hook.
 
 
 def open_load_file_dialog(browser):
@@ -35,15 +36,17 @@ def open_load_file_dialog(browser):
             # native doesn't seem to works
             options |= QFileDialog.DontUseNativeDialog
 
-            result = QFileDialog.getOpenFileName(
+            # Several files can be selected, to update different fields of the same notes in one pass.
+            result = QFileDialog.getOpenFileNames(
                 browser, "Import CSV for Batch Update", path, f"CSV (*{ext})",
                 options=options)
 
             if not isinstance(result, tuple):
                 raise Exception("Expected a tuple from save dialog")
-            file = result[0]
-            if file:
-                BatchUpdateDialog(browser, nids, file).exec_()
+            files = result[0]
+            if files:
+                from .dialogs.batch_update import BatchUpdateDialog
+                BatchUpdateDialog(browser, nids, files).exec_()
 
         except Exception as e:
             tooltip("Failed: {}".format(e))
@@ -52,6 +55,7 @@ def open_load_file_dialog(browser):
 
 
 def open_changelog_dialog(browser):
+    from .dialogs.change_log import ChangeLogDialog
     ChangeLogDialog(browser).exec_()
 
 
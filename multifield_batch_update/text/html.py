@@ -12,6 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import html
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]*>")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Whitespace that HTML collapses, which unlike \s doesn't include the non-breaking space.
+_HTML_WHITESPACE = " \t\n\r\f"
+_HTML_WHITESPACE_RE = re.compile("[{}]+".format(_HTML_WHITESPACE))
+
+# A non-breaking space on its own between other characters looks the same as a space.  Next to other
+# whitespace, or in a run, each one adds visible space.
+_LONE_NBSP_RE = re.compile("(?<![{0}\u00a0])\u00a0(?![{0}\u00a0])".format(_HTML_WHITESPACE))
+
+# Elements that flow within a line, so text on either side of their tags is adjacent.
+_INLINE_ELEMENTS = {"a", "abbr", "b", "big", "cite", "code", "em", "font", "i", "kbd", "mark", "q", "s", "small",
+                    "span", "strike", "strong", "sub", "sup", "u"}
+
+# Elements whose whitespace is shown as is.
+_PREFORMATTED_ELEMENTS = {"pre", "textarea", "listing", "plaintext", "xmp"}
+
+# Elements that never have content, so <br>, <br/> and <br /> are the same.
+_VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
 
 def spaces_to_nbsp(s):
     return s.replace(" ", "&nbsp;")
@@ -23,3 +50,128 @@ def ins_tag(s):
 
 def del_tag(s):
     return "<del>{}</del>".format(spaces_to_nbsp(s))
+
+
+def strip_html(s):
+    """Removes comments and tags, leaving only the text content."""
+    return _TAG_RE.sub("", _COMMENT_RE.sub("", s))
+
+
+def collapse_whitespace(s):
+    return _WHITESPACE_RE.sub(" ", s).strip()
+
+
+def normalize_key(s):
+    """Normalizes a join key value so that values which render the same in Anki compare equal.
+
+    HTML is stripped before entities are unescaped, so escaped markup such as &lt;b&gt; is kept as text.
+    Unescaping turns &nbsp; into a non-breaking space, which is then collapsed along with other whitespace.
+    """
+    return collapse_whitespace(html.unescape(strip_html(s))).casefold()
+
+
+class _CanonicalHTMLParser(HTMLParser):
+    """Reduces HTML to a tuple of tokens that only differ when the HTML renders differently."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tokens = []
+        self.text = []
+        # (tag, whether it preserves whitespace) for each element currently open
+        self.open_elements = []
+
+    def _preformatted(self):
+        return any(preserves for tag, preserves in self.open_elements)
+
+    def _end_text(self):
+        if self.text:
+            text = "".join(self.text)
+            if self._preformatted():
+                self.tokens.append(("pre", text))
+            else:
+                # runs of whitespace render as a single space
+                self.tokens.append(("text", _HTML_WHITESPACE_RE.sub(" ", text)))
+            self.text = []
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        self._end_text()
+        self.tokens.append(("start", tag, tuple(sorted((name, value or "") for name, value in attrs))))
+        if tag not in _VOID_ELEMENTS:
+            # Any white-space style is assumed to preserve whitespace, since the exact rendering isn't known.
+            preserves = tag in _PREFORMATTED_ELEMENTS or any(
+                name == "style" and value and "white-space" in value.lower() for name, value in attrs)
+            self.open_elements.append((tag, preserves))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._end_text()
+        if tag not in _VOID_ELEMENTS:
+            self.tokens.append(("end", tag))
+            # close the element and any left open inside it, ignoring end tags that were never opened
+            for i in range(len(self.open_elements) - 1, -1, -1):
+                if self.open_elements[i][0] == tag:
+                    del self.open_elements[i:]
+                    break
+
+    def close(self):
+        super().close()
+        self._end_text()
+
+
+# Only a small cache, since it lives as long as Anki does and planning rarely sees the same value twice,
+# but it still catches values that recur often such as empty fields or the same short answer.
+@lru_cache(maxsize=1024)
+def canonicalize_html(s):
+    """Returns a hashable canonical form of an HTML field value.
+
+    Tag and attribute name case, attribute order, self-closing syntax, entities versus the characters they
+    stand for, comments, runs of whitespace, a lone &nbsp; versus a space, and whitespace at either end are
+    all ignored.  Whitespace within preformatted elements, and runs of &nbsp;, are kept as they are since
+    they change how the field looks.
+    """
+    parser = _CanonicalHTMLParser()
+    parser.feed(s)
+    parser.close()
+    tokens = parser.tokens
+    if tokens and tokens[0][0] == "text":
+        tokens[0] = ("text", tokens[0][1].lstrip(_HTML_WHITESPACE))
+    if tokens and tokens[-1][0] == "text":
+        tokens[-1] = ("text", tokens[-1][1].rstrip(_HTML_WHITESPACE))
+    _lone_nbsp_to_space(tokens)
+    return tuple(token for token in tokens if token != ("text", ""))
+
+
+def _lone_nbsp_to_space(tokens):
+    """Replaces each &nbsp; that renders like a space with one, looking across inline tags at neighbouring text.
+
+    The ends of the field and other tags, such as <br> or <div>, count as whitespace, since a space is
+    dropped there while an &nbsp; still shows.
+    """
+    before = [""] * len(tokens)
+    after = [""] * len(tokens)
+    for order, neighbours in ((range(len(tokens)), before), (range(len(tokens) - 1, -1, -1), after)):
+        neighbour = ""
+        for i in order:
+            token = tokens[i]
+            if token[0] in ("text", "pre"):
+                neighbours[i] = neighbour
+                if token[1]:
+                    neighbour = token[1][-1] if neighbours is before else token[1][0]
+            elif token[1] not in _INLINE_ELEMENTS:
+                neighbour = ""
+    for i, token in enumerate(tokens):
+        if token[0] == "text" and "\u00a0" in token[1]:
+            padded = (before[i] or " ") + token[1] + (after[i] or " ")
+            tokens[i] = ("text", _LONE_NBSP_RE.sub(" ", padded)[1:-1])
+
+
+def html_equivalent(a, b):
+    """Whether two field values render the same, checking plain equality before parsing either."""
+    return a == b or canonicalize_html(a) == canonicalize_html(b)
@@ -10,6 +10,8 @@ TEMP_DIR=`mktemp -d`
 echo Using temp dir $TEMP_DIR
 cp manifest.json $TEMP_DIR
 cp multifield_batch_update/*.py $TEMP_DIR
+mkdir $TEMP_DIR/batch
+cp multifield_batch_update/batch/*.py $TEMP_DIR/batch
 mkdir $TEMP_DIR/db
 cp multifield_batch_update/db/*.py $TEMP_DIR/db
 mkdir $TEMP_DIR/dialogs
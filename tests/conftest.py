@@ -0,0 +1,141 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+import sys
+import types
+
+import pytest
+
+try:
+    import anki.db  # noqa: F401
+    import anki.utils  # noqa: F401
+except ImportError:
+    # Stand-ins for the parts of Anki the add-on's modules import, so they can be tested without Anki installed.
+    class DB:
+        def __init__(self, path):
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self.mod = False
+
+        def setAutocommit(self, autocommit):
+            self._db.isolation_level = None if autocommit else ""
+
+        def execute(self, sql, *args):
+            self.mod = True
+            return self._db.execute(sql, args)
+
+        def executemany(self, sql, rows):
+            self.mod = True
+            self._db.executemany(sql, rows)
+
+        def executescript(self, sql):
+            self._db.executescript(sql)
+
+        def scalar(self, sql, *args):
+            return self._db.execute(sql, args).fetchone()[0]
+
+        def all(self, sql, *args):
+            return self._db.execute(sql, args).fetchall()
+
+        def commit(self):
+            self._db.commit()
+
+        def close(self):
+            self._db.close()
+
+    def ids2str(ids):
+        return "({})".format(",".join(str(i) for i in ids))
+
+    def splitFields(string):
+        return string.split("\x1f")
+
+    sys.modules["anki"] = types.ModuleType("anki")
+    sys.modules["anki"].Collection = None
+    sys.modules["anki.db"] = types.ModuleType("anki.db")
+    sys.modules["anki.db"].DB = DB
+    sys.modules["anki.utils"] = types.ModuleType("anki.utils")
+    sys.modules["anki.utils"].ids2str = ids2str
+    sys.modules["anki.utils"].splitFields = splitFields
+
+FIELD_NAMES = ["Word", "POS", "Back"]
+MODEL_ID = 1
+
+
+class FakeNote:
+    def __init__(self, col, nid):
+        row = col.db.all("select mid, mod, flds from notes where id = ?", nid)
+        if not row:
+            # what Anki raises for a missing note
+            raise TypeError("cannot unpack non-iterable NoneType object")
+        self.col = col
+        self.id = nid
+        self.mid, self.mod, flds = row[0]
+        self.fields = flds.split("\x1f")
+
+    def model(self):
+        return {"id": self.mid}
+
+    def __contains__(self, name):
+        return name in FIELD_NAMES
+
+    def __getitem__(self, name):
+        return self.fields[FIELD_NAMES.index(name)]
+
+    def __setitem__(self, name, value):
+        self.fields[FIELD_NAMES.index(name)] = value
+
+    def flush(self):
+        self.mod += 1
+        self.col.db.execute("update notes set mod = ?, flds = ? where id = ?", self.mod, "\x1f".join(self.fields),
+                            self.id)
+
+
+class FakeModels:
+    def fieldNames(self, model):
+        return list(FIELD_NAMES)
+
+
+class FakeDB:
+    def __init__(self):
+        self._db = sqlite3.connect(":memory:")
+        self._db.execute("create table notes (id integer primary key, mid integer, mod integer, flds text)")
+
+    def execute(self, sql, *args):
+        return self._db.execute(sql, args)
+
+    def all(self, sql, *args):
+        return self._db.execute(sql, args).fetchall()
+
+
+class FakeCollection:
+    """An in-memory collection of notes with the fields in FIELD_NAMES."""
+
+    def __init__(self):
+        self.db = FakeDB()
+        self.models = FakeModels()
+
+    def add_note(self, nid, *fields, mod=100, mid=MODEL_ID):
+        fields = list(fields) + [""] * (len(FIELD_NAMES) - len(fields))
+        self.db.execute("insert into notes values (?, ?, ?, ?)", nid, mid, mod, "\x1f".join(fields))
+
+    def getNote(self, nid):
+        return FakeNote(self, nid)
+
+    def fields(self, nid):
+        return self.getNote(nid).fields
+
+
+@pytest.fixture
+def col():
+    return FakeCollection()
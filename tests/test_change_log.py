@@ -0,0 +1,128 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+import threading
+
+import pytest
+
+from multifield_batch_update.db.change_log import ChangeLog, ChangeLogEntry, search_query
+
+
+def _record(changelog, *values):
+    changelog.record_and_commit_changes("batch_update", 1, [
+        ChangeLogEntry(ts=i, nid=i, fld="Back", old=old, new=new) for i, (old, new) in enumerate(values)])
+
+
+@pytest.fixture
+def changelog(tmpdir):
+    changelog = ChangeLog(str(tmpdir.join("changelog.db")))
+    yield changelog
+    changelog.close()
+
+
+def test_search_query():
+    assert search_query("") == ""
+    assert search_query("  red  apple ") == '"red" "apple"'
+    assert search_query("colo*") == '"colo"*'
+    assert search_query('say "hi"') == '"say" """hi"""'
+    assert search_query("a-b OR NOT c") == '"a-b" "OR" "NOT" "c"'
+    assert search_query("*") == '"*"'
+
+
+def test_search_old_and_new_values(changelog):
+    _record(changelog, ("red apple", "green apple"), ("banana", "ripe banana"), ("colour", "color"))
+    assert [row[4:] for row in changelog.search("apple", 10)] == [("red apple", "green apple")]
+    assert [row[5] for row in changelog.search("ripe", 10)] == ["ripe banana"]
+    assert [row[5] for row in changelog.search("colo*", 10)] == ["color"]
+    assert changelog.search("red banana", 10) == []
+    assert changelog.search('"NEAR(', 10) == []
+
+
+def test_search_pages_newest_first(changelog):
+    _record(changelog, *[("value {}".format(i), "new") for i in range(5)])
+    assert [row[2] for row in changelog.search("value", 2)] == [4, 3]
+    assert [row[2] for row in changelog.search("value", 2, 2)] == [2, 1]
+    assert [row[2] for row in changelog.search("", 2, 4)] == [0]
+
+
+def test_search_index_built_for_existing_log(tmpdir):
+    path = str(tmpdir.join("changelog.db"))
+    db = sqlite3.connect(path)
+    db.executescript("""
+        create table changelog (
+          id integer primary key, op text not null, init_ts integer not null, ts integer not null,
+          nid integer not null, fld text not null, old text not null, new text not null
+        );
+        insert into changelog (op, init_ts, ts, nid, fld, old, new) values ('batch_update', 1, 1, 7, 'Back', 'a', 'b');
+    """)
+    db.close()
+
+    changelog = ChangeLog(path)
+    try:
+        assert [row[2] for row in changelog.search("b", 10)] == [7]
+        _record(changelog, ("c", "b"))
+        assert [row[2] for row in changelog.search("b", 10)] == [0, 7]
+        changelog.rebuild_search_index()
+        assert [row[2] for row in changelog.search("b", 10)] == [0, 7]
+    finally:
+        changelog.close()
+
+
+def _writer_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "changelog-writer"]
+
+
+def test_flush_commits_recorded_changes(changelog):
+    _record(changelog, ("a", "b"), ("c", "d"))
+    changelog.record_change("batch_update", 2, ChangeLogEntry(ts=5, nid=5, fld="Back", old="e", new="f"))
+    changelog.flush()
+    assert changelog.all("select nid, old, new from changelog order by id") == [
+        (0, "a", "b"), (1, "c", "d"), (5, "e", "f")]
+
+
+def test_flush_reports_write_errors_once(changelog):
+    changelog.record_change("batch_update", 1, ChangeLogEntry(ts=1, nid=1, fld="Back", old=None, new="b"))
+    with pytest.raises(sqlite3.IntegrityError):
+        changelog.flush()
+    changelog.flush()
+    _record(changelog, ("a", "b"))
+    assert changelog.all("select count() from changelog") == [(1,)]
+
+
+def test_close_with_pending_error_still_closes(tmpdir):
+    changelog = ChangeLog(str(tmpdir.join("changelog.db")))
+    changelog.record_change("batch_update", 1, ChangeLogEntry(ts=1, nid=1, fld="Back", old=None, new="b"))
+    with pytest.raises(sqlite3.IntegrityError):
+        changelog.close()
+    assert not changelog._writer.is_alive()
+    changelog.close()
+
+
+def test_use_after_close_raises(tmpdir):
+    changelog = ChangeLog(str(tmpdir.join("changelog.db")))
+    changelog.close()
+    with pytest.raises(RuntimeError):
+        changelog.flush()
+    with pytest.raises(RuntimeError):
+        changelog.search("a", 10)
+    with pytest.raises(RuntimeError):
+        changelog.record_change("batch_update", 1, ChangeLogEntry(ts=1, nid=1, fld="Back", old="a", new="b"))
+
+
+def test_open_failure_stops_writer(tmpdir):
+    threads = len(_writer_threads())
+    with pytest.raises(Exception):
+        ChangeLog(str(tmpdir.join("missing", "changelog.db")))
+    assert len(_writer_threads()) == threads
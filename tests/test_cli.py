@@ -0,0 +1,49 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from multifield_batch_update import cli
+from multifield_batch_update.batch.planner import BatchUpdateError
+
+FILE_FIELD_NAMES = ["nid", "Word", "POS", "Def", "Back"]
+NOTE_FIELD_NAMES = ["Word", "POS", "Back"]
+
+
+def _mappings(argv, note_join_key_name):
+    args = cli.parse_args(["collection.anki2", "changes.csv"] + argv)
+    mappings = cli._build_mappings(args, FILE_FIELD_NAMES, NOTE_FIELD_NAMES, note_join_key_name)
+    return {mapping.file_field: mapping.note_field for mapping in mappings}
+
+
+def test_default_mappings_leave_out_join_key_fields():
+    assert _mappings([], ("Word", "POS")) == {"Back": "Back"}
+    assert _mappings([], "nid") == {"Word": "Word", "POS": "POS", "Back": "Back"}
+
+
+def test_explicit_mappings():
+    assert _mappings(["--map", "Def=Back"], "Word") == {"Def": "Back"}
+
+
+@pytest.mark.parametrize("argv, note_join_key_name", [
+    (["--map", "Def=Word"], "Word"),
+    (["--map", "Def=POS"], ("Word", "POS")),
+    (["--map", "nid=Back"], "Word"),
+    (["--map", "Def=Missing"], "Word"),
+    (["--map", "Missing=Back"], "Word"),
+    (["--map", "Def=Back", "--transform", "Word", "Append", ";"], "nid"),
+])
+def test_invalid_mappings(argv, note_join_key_name):
+    with pytest.raises(BatchUpdateError):
+        _mappings(argv, note_join_key_name)
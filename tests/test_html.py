@@ -0,0 +1,62 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from multifield_batch_update.text.html import canonicalize_html, html_equivalent
+
+
+@pytest.mark.parametrize("a, b", [
+    ("<br>", "<br/>"),
+    ("<br>", "<BR />"),
+    ('<b class="x" id="y">a</b>', "<B id=y class=x>a</B>"),
+    ("a&amp;b", "a&b"),
+    ("&lt;", "&#60;"),
+    ("a  \n\tb", "a b"),
+    ("  a  ", "a"),
+    ("a<!-- note -->b", "ab"),
+    ("a&nbsp;b", "a b"),
+    ("<b>a</b>&nbsp;<i>b</i>", "<b>a</b> <i>b</i>"),
+    ("<div>a&nbsp;b</div>", "<div>a b</div>"),
+    ("<pre>a</pre>  x   y", "<pre>a</pre> x y"),
+])
+def test_equivalent(a, b):
+    assert html_equivalent(a, b)
+    assert canonicalize_html(a) == canonicalize_html(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("a", "b"),
+    ("<b>a</b>", "<i>a</i>"),
+    ('<a href="x">a</a>', '<a href="y">a</a>'),
+    ("a&nbsp;&nbsp;&nbsp;b", "a b"),
+    ("a&nbsp;&nbsp;b", "a&nbsp;b"),
+    ("a &nbsp;b", "a b"),
+    ("&nbsp;a", "a"),
+    ("a&nbsp;", "a"),
+    ("x<br>&nbsp;y", "x<br> y"),
+    ("a&nbsp;<b>&nbsp;b</b>", "a <b> b</b>"),
+    ("<pre>x\n  y</pre>", "<pre>x y</pre>"),
+    ("<pre><b>x  y</b></pre>", "<pre><b>x y</b></pre>"),
+    ("<pre>x\n", "<pre>x"),
+    ("<textarea>x  y</textarea>", "<textarea>x y</textarea>"),
+    ('<span style="white-space: pre-wrap">x  y</span>', '<span style="white-space: pre-wrap">x y</span>'),
+])
+def test_not_equivalent(a, b):
+    assert not html_equivalent(a, b)
+
+
+def test_whitespace_collapsed_again_after_preformatted_element():
+    assert html_equivalent("<pre>x  y</pre><p>a  b</p>", "<pre>x  y</pre><p>a b</p>")
+    assert not html_equivalent("<pre>x  y</pre><p>a  b</p>", "<pre>x y</pre><p>a b</p>")
@@ -0,0 +1,76 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from multifield_batch_update.batch.join import KeyIndex, format_key, normalize_each
+from multifield_batch_update.text.html import normalize_key
+
+
+def test_key_index_without_normalize():
+    index = KeyIndex()
+    assert index.add("foo", 1) == "foo"
+    index.add("Foo", 2)
+    assert index.get("foo") == 1
+    assert index.get("Foo") == 2
+    assert index.get("bar") is None
+    assert len(index) == 2
+    assert not index.has_errors()
+
+
+def test_key_index_duplicates():
+    index = KeyIndex()
+    index.add("foo", 1)
+    index.add("foo", 2)
+    assert index.duplicates == {"foo"}
+    assert not index.collisions
+    assert index.get("foo") == 1
+    assert index.has_errors()
+
+
+def test_key_index_collisions():
+    index = KeyIndex(normalize_key)
+    key = index.add("<b>Foo</b>", 1)
+    assert key == "foo"
+    assert index.add("foo ", 2) == "foo"
+    assert index.collisions == {"foo": {"<b>Foo</b>", "foo "}}
+    assert not index.duplicates
+    assert index.raw("foo") == "<b>Foo</b>"
+    assert index.get("foo") == 1
+
+
+def test_key_index_normalized_duplicate_is_not_collision():
+    index = KeyIndex(normalize_key)
+    index.add("Foo", 1)
+    index.add("Foo", 2)
+    assert index.duplicates == {"Foo"}
+    assert not index.collisions
+
+
+def test_normalize_each():
+    index = KeyIndex(normalize_each(normalize_key))
+    assert index.add(("Run", "<i>Verb</i>"), 1) == ("run", "verb")
+    index.add(("Run", "Noun"), 2)
+    assert index.get(("run", "noun")) == 2
+    assert not index.has_errors()
+
+
+def test_format_key():
+    assert format_key("foo") == "foo"
+    assert format_key(("foo", "bar")) == "foo + bar"
+
+
+def test_normalize_key():
+    assert normalize_key("  <b>Hello</b>&nbsp;&nbsp;World\n") == "hello world"
+    assert normalize_key("&lt;b&gt;") == "<b>"
+    assert normalize_key("a<!-- comment -->b") == "ab"
+    assert normalize_key("STRASSE") == normalize_key("straße")
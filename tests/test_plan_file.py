@@ -0,0 +1,120 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import gzip
+import json
+
+import pytest
+
+from multifield_batch_update import cli
+from multifield_batch_update.batch import plan_file
+from multifield_batch_update.batch.plan_file import find_stale_notes, read_plan, without_notes, write_plan
+from multifield_batch_update.batch.plan_store import NoteChange, PlanStore
+from multifield_batch_update.batch.planner import BatchUpdateError, Plan
+
+
+def _ignore(msg):
+    pass
+
+
+def _plan(*notes):
+    """Makes a plan from (nid, mod, {field: (old, new)}) for each note."""
+    note_changes = PlanStore()
+    for nid, mod, fields in notes:
+        note_changes.add_note(nid, mod, [NoteChange(nid=nid, fld=fld, old=old, new=new)
+                                         for fld, (old, new) in fields.items()])
+    return Plan(note_changes=note_changes, empty_note_field_count=0, empty_note_count=0,
+                skipped_field_count=0, skipped_note_count=0, skipped_sync_bytes=0)
+
+
+def test_cli_saved_plan_keeps_notes_that_are_not_stale(col, tmpdir):
+    col.add_note(1, "run", "verb", "old 1")
+    col.add_note(2, "walk", "verb", "old 2")
+    path = str(tmpdir.join("changes.plan"))
+    write_plan(path, _plan((1, 100, {"Back": ("old 1", "new 1")}), (2, 100, {"Back": ("old 2", "new 2")})))
+    col.getNote(2).flush()
+
+    summary = {}
+    plan = cli._plan_from_saved(col, argparse.Namespace(plan=path, memory_limit=1), summary, _ignore)
+    try:
+        assert list(plan.note_changes.items()) == [(1, [NoteChange(nid=1, fld="Back", old="old 1", new="new 1")])]
+        assert summary["notes_skipped_modified"] == [2]
+        assert summary["notes_skipped_deleted"] == []
+    finally:
+        plan.note_changes.close()
+
+
+def test_write_and_read_plan(tmpdir):
+    path = str(tmpdir.join("changes.plan"))
+    plan = _plan((2, 200, {"Back": ("", "new 2"), "POS": ("noun", "verb")}), (1, 100, {"Back": ("old 1", "new 1")}))
+    plan = plan._replace(empty_note_field_count=1, empty_note_count=1, skipped_field_count=3)
+    write_plan(path, plan, file="changes.csv", model_id=7)
+
+    header, loaded = read_plan(path)
+    try:
+        assert header["file"] == "changes.csv"
+        assert header["model_id"] == 7
+        assert list(loaded.note_changes.grouped()) == list(plan.note_changes.grouped())
+        assert loaded._replace(note_changes=None) == plan._replace(note_changes=None)
+    finally:
+        loaded.note_changes.close()
+
+
+def test_read_plan_rejects_other_versions(tmpdir):
+    path = str(tmpdir.join("changes.plan"))
+    with gzip.open(path, "wt", encoding="utf-8") as outf:
+        outf.write(json.dumps({"version": 999}) + "\n")
+    with pytest.raises(BatchUpdateError):
+        read_plan(path)
+
+
+def test_read_plan_without_skipped_counts(tmpdir):
+    path = str(tmpdir.join("changes.plan"))
+    with gzip.open(path, "wt", encoding="utf-8") as outf:
+        outf.write(json.dumps({"version": 1, "empty_note_field_count": 1, "empty_note_count": 1}) + "\n")
+        outf.write(json.dumps([1, 100, [["Back", "", "new"]]]) + "\n")
+    header, plan = read_plan(path)
+    try:
+        assert list(plan.note_changes.nids()) == [1]
+        assert (plan.skipped_field_count, plan.skipped_note_count, plan.skipped_sync_bytes) == (0, 0, 0)
+    finally:
+        plan.note_changes.close()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 10000])
+def test_find_stale_notes(col, monkeypatch, chunk_size):
+    monkeypatch.setattr(plan_file, "VALIDATE_CHUNK_SIZE", chunk_size)
+    col.add_note(1, "run", mod=100)
+    col.add_note(2, "walk", mod=150)
+    col.add_note(3, "jump", mod=100)
+    changed, missing = find_stale_notes(col, iter([(1, 100), (2, 100), (3, 100), (4, 100)]))
+    assert changed == {2}
+    assert missing == {4}
+
+
+def test_without_notes_recounts_empty_fields():
+    plan = _plan((1, 100, {"Back": ("", "new 1"), "POS": ("", "verb")}),
+                 (2, 100, {"Back": ("", "new 2")}),
+                 (3, 100, {"Back": ("old 3", "new 3")}))
+    plan = plan._replace(empty_note_field_count=3, empty_note_count=2, skipped_field_count=5)
+    filtered = without_notes(plan, {1})
+    try:
+        assert list(filtered.note_changes.nids()) == [2, 3]
+        assert filtered.empty_note_field_count == 1
+        assert filtered.empty_note_count == 1
+        assert filtered.skipped_field_count == 5
+        assert list(plan.note_changes.nids()) == [1, 2, 3]
+    finally:
+        filtered.note_changes.close()
@@ -0,0 +1,89 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+from multifield_batch_update.batch.plan_store import _CHANGE_OVERHEAD, NoteChange, PlanStore
+
+
+def _changes(nid, *fields):
+    return [NoteChange(nid=nid, fld=fld, old="old {}".format(fld), new="new {}".format(fld)) for fld in fields]
+
+
+NOTES = [
+    (30, 300, _changes(30, "Front", "Back")),
+    (10, 100, _changes(10, "Back")),
+    (20, 200, _changes(20, "Front", "Back", "Extra")),
+]
+
+
+def _fill(store):
+    for nid, mod, changes in NOTES:
+        store.add_note(nid, mod, changes)
+    return store
+
+
+@pytest.fixture(params=[None, 0], ids=["memory", "spilled"])
+def store(request):
+    store = PlanStore() if request.param is None else PlanStore(request.param)
+    yield _fill(store)
+    store.close()
+
+
+def test_counts(store):
+    assert len(store) == 3
+    assert store.change_count() == 6
+    assert store.field_names == ["Front", "Back", "Extra"]
+
+
+def test_grouped_keeps_insertion_order(store):
+    assert list(store.grouped()) == NOTES
+    assert list(store.items()) == [(nid, changes) for nid, mod, changes in NOTES]
+    assert list(store.notes()) == [(30, 300), (10, 100), (20, 200)]
+    assert list(store.nids()) == [30, 10, 20]
+
+
+def test_without_notes(store):
+    remaining = store.without_notes({10})
+    try:
+        assert list(remaining.grouped()) == [NOTES[0], NOTES[2]]
+        assert len(remaining) == 2
+        assert remaining.change_count() == 5
+    finally:
+        remaining.close()
+
+
+def test_spill_threshold():
+    size = sum(len(change.old) + len(change.new) + _CHANGE_OVERHEAD for change in NOTES[0][2])
+    store = PlanStore(size)
+    try:
+        store.add_note(*NOTES[0])
+        assert not store.spilled
+        store.add_note(*NOTES[1])
+        assert store.spilled
+        store.add_note(*NOTES[2])
+        assert list(store.grouped()) == NOTES
+    finally:
+        store.close()
+
+
+def test_close_removes_temporary_database():
+    store = _fill(PlanStore(0))
+    path = store._db_path
+    assert os.path.exists(path)
+    store.close()
+    assert not os.path.exists(path)
+    store.close()
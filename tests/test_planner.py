@@ -0,0 +1,138 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+
+import pytest
+
+from multifield_batch_update.batch.plan_store import NoteChange
+from multifield_batch_update.batch.planner import BatchUpdateError, FieldMapping, FileJob, plan_jobs
+from multifield_batch_update.batch.transforms import VALUE, compile_transform
+from multifield_batch_update.text.html import normalize_key
+
+
+def _write_csv(tmpdir, name, rows):
+    path = str(tmpdir.join(name))
+    with open(path, "w", encoding="utf-8", newline="") as outf:
+        writer = csv.writer(outf)
+        writer.writerows(rows)
+    return path
+
+
+def _job(path, file_join_key, note_join_key, mappings, normalize=None):
+    with open(path, encoding="utf-8") as inf:
+        file_field_names = next(csv.reader(inf))
+    return FileJob(path, file_join_key, note_join_key, [
+        FieldMapping(column, field, compile_transform(VALUE, column, "", "", file_field_names))
+        for column, field in mappings.items()], normalize)
+
+
+def _grouped(plan):
+    try:
+        return list(plan.note_changes.grouped())
+    finally:
+        plan.note_changes.close()
+
+
+def test_files_updating_different_fields_are_merged(col, tmpdir):
+    col.add_note(1, "run", "noun", "old")
+    col.add_note(2, "walk", "verb", "old")
+    pos = _write_csv(tmpdir, "pos.csv", [["Word", "POS"], ["run", "verb"]])
+    back = _write_csv(tmpdir, "back.csv", [["nid", "Back"], ["1", "to move fast"], ["2", "old"]])
+
+    plan = plan_jobs(col, [1, 2], [_job(pos, "Word", "Word", {"POS": "POS"}),
+                                   _job(back, "nid", "nid", {"Back": "Back"})])
+    assert _grouped(plan) == [(1, 100, [
+        NoteChange(nid=1, fld="POS", old="noun", new="verb"),
+        NoteChange(nid=1, fld="Back", old="old", new="to move fast"),
+    ])]
+
+
+def test_files_setting_a_field_to_different_values_conflict(col, tmpdir):
+    col.add_note(1, "run", "noun", "old")
+    first = _write_csv(tmpdir, "first.csv", [["Word", "Back"], ["run", "one"]])
+    second = _write_csv(tmpdir, "second.csv", [["nid", "Back"], ["1", "two"]])
+
+    with pytest.raises(BatchUpdateError) as e:
+        plan_jobs(col, [1], [_job(first, "Word", "Word", {"Back": "Back"}),
+                             _job(second, "nid", "nid", {"Back": "Back"})])
+    assert "first.csv" in str(e.value) and "second.csv" in str(e.value)
+
+
+def test_files_setting_a_field_to_the_same_value_do_not_conflict(col, tmpdir):
+    col.add_note(1, "run", "noun", "old")
+    first = _write_csv(tmpdir, "first.csv", [["Word", "Back"], ["run", "same"]])
+    second = _write_csv(tmpdir, "second.csv", [["nid", "Back"], ["1", "same"]])
+
+    plan = plan_jobs(col, [1], [_job(first, "Word", "Word", {"Back": "Back"}),
+                                _job(second, "nid", "nid", {"Back": "Back"})])
+    assert _grouped(plan) == [(1, 100, [NoteChange(nid=1, fld="Back", old="old", new="same")])]
+
+
+@pytest.fixture
+def homographs(col):
+    # the words are only unique together with their part of speech
+    col.add_note(1, "run", "verb", "old 1")
+    col.add_note(2, "run", "noun", "old 2")
+    col.add_note(3, "<b>Walk</b>", "verb", "old 3")
+    return col
+
+
+def test_composite_join_key(homographs, tmpdir):
+    path = _write_csv(tmpdir, "back.csv", [
+        ["Word", "POS", "Back"], ["run", "noun", "a run"], ["run", "verb", "to run"]])
+    plan = plan_jobs(homographs, [1, 2, 3], [_job(path, ("Word", "POS"), ("Word", "POS"), {"Back": "Back"})])
+    assert sorted(_grouped(plan)) == [
+        (1, 100, [NoteChange(nid=1, fld="Back", old="old 1", new="to run")]),
+        (2, 100, [NoteChange(nid=2, fld="Back", old="old 2", new="a run")]),
+    ]
+
+
+def test_composite_join_key_normalizes_each_part(homographs, tmpdir):
+    path = _write_csv(tmpdir, "back.csv", [["Word", "POS", "Back"], [" walk", "VERB", "to walk"]])
+    plan = plan_jobs(homographs, [1, 2, 3], [_job(path, ("Word", "POS"), ("Word", "POS"), {"Back": "Back"},
+                                                  normalize=normalize_key)])
+    assert _grouped(plan) == [(3, 100, [NoteChange(nid=3, fld="Back", old="old 3", new="to walk")])]
+
+
+def test_composite_join_key_not_unique_in_notes(homographs, tmpdir):
+    path = _write_csv(tmpdir, "back.csv", [["Word", "Back"], ["run", "to run"]])
+    with pytest.raises(BatchUpdateError) as e:
+        plan_jobs(homographs, [1, 2, 3], [_job(path, "Word", "Word", {"Back": "Back"})])
+    assert "Value 'run' already exists in notes" in str(e.value)
+
+
+def test_composite_join_key_duplicate_in_file(homographs, tmpdir):
+    path = _write_csv(tmpdir, "back.csv", [["Word", "POS", "Back"], ["run", "verb", "a"], ["run", "verb", "b"]])
+    with pytest.raises(BatchUpdateError) as e:
+        plan_jobs(homographs, [1, 2, 3], [_job(path, ("Word", "POS"), ("Word", "POS"), {"Back": "Back"})])
+    assert "run + verb" in str(e.value)
+
+
+def test_composite_join_key_missing_in_notes(homographs, tmpdir):
+    path = _write_csv(tmpdir, "back.csv", [["Word", "POS", "Back"], ["run", "adjective", "a"]])
+    with pytest.raises(BatchUpdateError) as e:
+        plan_jobs(homographs, [1, 2, 3], [_job(path, ("Word", "POS"), ("Word", "POS"), {"Back": "Back"})])
+    assert "1 values were not found in notes for field 'Word + POS'" in str(e.value)
+
+
+@pytest.mark.parametrize("file_join_key, note_join_key, message", [
+    (("Word", "POS"), "Word", "different number of fields"),
+    (("Word", "POS"), ("nid", "POS"), "nid can't be combined"),
+])
+def test_invalid_composite_join_keys(homographs, tmpdir, file_join_key, note_join_key, message):
+    path = _write_csv(tmpdir, "back.csv", [["Word", "POS", "Back"], ["run", "verb", "a"]])
+    with pytest.raises(BatchUpdateError) as e:
+        plan_jobs(homographs, [1, 2, 3], [_job(path, file_join_key, note_join_key, {"Back": "Back"})])
+    assert message in str(e.value)
@@ -0,0 +1,73 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+import sys
+
+# Seconds the add-on may take to load when Anki starts, with Anki itself already imported.
+STARTUP_BUDGET = 0.2
+
+# Modules that should only be imported the first time a menu action is used.
+LAZY_MODULES = [
+    "multifield_batch_update.dialogs.batch_update",
+    "multifield_batch_update.dialogs.change_log",
+    "multifield_batch_update.dialogs.file_mapping",
+    "multifield_batch_update.batch.planner",
+    "multifield_batch_update.batch.diff",
+    "multifield_batch_update.db.change_log",
+    "difflib",
+    "csv",
+]
+
+# Runs in a fresh interpreter so that modules imported by pytest or other tests don't hide an eager import.
+_IMPORT_SCRIPT = """
+import json
+import sys
+import time
+import types
+
+for name in ["anki", "anki.hooks", "aqt", "aqt.qt", "aqt.utils"]:
+    sys.modules[name] = types.ModuleType(name)
+sys.modules["anki.hooks"].addHook = lambda hook, fn: None
+sys.modules["aqt.qt"].QFileDialog = object
+sys.modules["aqt.qt"].QStandardPaths = object
+sys.modules["aqt.utils"].tooltip = lambda msg: None
+
+start = time.perf_counter()
+import multifield_batch_update.setup_menus  # noqa: E402,F401
+elapsed = time.perf_counter() - start
+
+print(json.dumps({"elapsed": elapsed, "loaded": list(sys.modules)}))
+"""
+
+
+def _import_setup_menus():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, "-c", _IMPORT_SCRIPT], cwd=root)
+    return json.loads(output.decode("utf-8"))
+
+
+def test_setup_menus_does_not_import_dialogs():
+    loaded = _import_setup_menus()["loaded"]
+    for name in LAZY_MODULES:
+        assert name not in loaded
+    assert not [name for name in loaded if name.startswith("multifield_batch_update.batch")]
+
+
+def test_setup_menus_import_within_budget():
+    # Take the best of a few runs so a busy machine doesn't make the test flaky.
+    elapsed = min(_import_setup_menus()["elapsed"] for _ in range(3))
+    assert elapsed < STARTUP_BUDGET
@@ -0,0 +1,80 @@
+# Copyright 2019 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from multifield_batch_update.batch.transforms import (APPEND, PREPEND, REGEX_REPLACE, TEMPLATE, VALUE, TransformError,
+                                                      compile_transform, describe_transform)
+
+FIELDS = ["Word", "POS", "Back"]
+ROW = {"Word": "run", "POS": "verb", "Back": "to move fast"}
+
+
+def test_value():
+    assert compile_transform(VALUE, "Back", "", "", FIELDS)(ROW, "old") == "to move fast"
+
+
+def test_template():
+    transform = compile_transform(TEMPLATE, "Back", "<b>{{Word}}</b> ({{POS}})", "", FIELDS)
+    assert transform(ROW, "old") == "<b>run</b> (verb)"
+
+
+def test_template_unknown_column():
+    with pytest.raises(TransformError):
+        compile_transform(TEMPLATE, "Back", "{{Missing}}", "", FIELDS)
+
+
+def test_template_empty():
+    with pytest.raises(TransformError):
+        compile_transform(TEMPLATE, "Back", "", "", FIELDS)
+
+
+def test_regex_replace():
+    transform = compile_transform(REGEX_REPLACE, "Back", r"to (\w+)", r"<i>\1</i>", FIELDS)
+    assert transform(ROW, "old") == "<i>move</i> fast"
+
+
+@pytest.mark.parametrize("pattern, replacement", [
+    ("", "x"),
+    ("(", "x"),
+    ("move", r"\1"),
+    ("(move)", r"\2"),
+    ("(?P<verb>move)", r"\g<noun>"),
+])
+def test_regex_replace_invalid(pattern, replacement):
+    with pytest.raises(TransformError):
+        compile_transform(REGEX_REPLACE, "Back", pattern, replacement, FIELDS)
+
+
+def test_append():
+    transform = compile_transform(APPEND, "Word", "; ", "", FIELDS)
+    assert transform(ROW, "walk") == "walk; run"
+    assert transform(ROW, "") == "run"
+    assert transform({"Word": ""}, "walk") == "walk"
+
+
+def test_prepend():
+    transform = compile_transform(PREPEND, "Word", "; ", "", FIELDS)
+    assert transform(ROW, "walk") == "run; walk"
+    assert transform(ROW, "") == "run"
+
+
+def test_unknown_kind():
+    with pytest.raises(TransformError):
+        compile_transform("Shout", "Word", "", "", FIELDS)
+
+
+def test_describe_transform():
+    assert describe_transform(VALUE, "", "") == ""
+    assert describe_transform(REGEX_REPLACE, "a", "b") == " (Regex Replace 'a' -> 'b')"